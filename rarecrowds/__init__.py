@@ -1,5 +1,27 @@
-from rarecrowds.rarecrowds import PhenotypicDatabase
-from rarecrowds.utils.disease_annotations import DiseaseAnnotations
-from rarecrowds.utils.hpo import Hpo
-from rarecrowds.utils.patient_sim import PatientSampler
-from rarecrowds.utils.phenotypic_comparison import PhenotypicComparison
+import importlib
+
+# Public classes are imported on first access, so that `import rarecrowds`
+# does not pull in pandas, plotly, the Azure SDK or networkx.
+_LAZY_ATTRIBUTES = {
+    "PhenotypicDatabase": "rarecrowds.rarecrowds",
+    "DiseaseAnnotations": "rarecrowds.utils.disease_annotations",
+    "DiseaseRanker": "rarecrowds.utils.ranking",
+    "Hpo": "rarecrowds.utils.hpo",
+    "PatientSampler": "rarecrowds.utils.patient_sim",
+    "PhenotypicComparison": "rarecrowds.utils.phenotypic_comparison",
+    "TermSimilarity": "rarecrowds.utils.term_similarity",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
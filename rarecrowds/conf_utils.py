@@ -1,5 +1,4 @@
 import configparser
-import pkg_resources
 import os
 
 
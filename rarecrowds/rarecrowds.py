@@ -1,20 +1,133 @@
-import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import os
-from typing import Dict, List
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, NamedTuple
 
-from google.protobuf.json_format import Parse, MessageToJson
-import pandas as pd
+import numpy as np
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.json_format import MessageToDict, Parse
 
 from rarecrowds.phenopackets_pb2 import Phenopacket
+from rarecrowds.utils import phenopacket_cache
+from rarecrowds.utils.closure import gather_rows
 from rarecrowds.utils.azure_utils import download_data, ALLOWED_CONTAINERS
 from rarecrowds.utils.patient_sim import PatientSampler
+from rarecrowds.utils.sqlite_store import SqliteStore
+from rarecrowds.utils.term_index import TermIndex
+
+if TYPE_CHECKING:
+    import pandas as pd
+    import scipy.sparse
 
 DATA_PATH = "rarecrowds_data"
 
 
+class IncidenceMatrix(NamedTuple):
+    """Patient by HPO term matrices with their row and column labels."""
+
+    observed: "scipy.sparse.csr_matrix"
+    excluded: "scipy.sparse.csr_matrix"
+    rows: np.ndarray
+    columns: np.ndarray
+
+
+class LoadError(NamedTuple):
+    """A phenopacket file that could not be loaded."""
+
+    path: str
+    error: str
+
+
+class PhenopacketLoadError(Exception):
+    """Raised when a phenopacket file cannot be loaded, see LoadError."""
+
+    def __init__(self, path: str, error: str):
+        super().__init__(f"{path}: {error}")
+        self.path = path
+        self.error = error
+
+
+class LoadProgress(NamedTuple):
+    """Progress of a folder load, passed to the progress callback."""
+
+    done: int
+    total: int
+    loaded: int
+    skipped: int
+    errors: int
+    seconds: float
+
+    @property
+    def files_per_second(self) -> float:
+        return self.done / self.seconds if self.seconds else 0.0
+
+
+def _parse_phenopacket(data):
+    """Parse JSON bytes into (phenopacket, None), or (None, error)."""
+    try:
+        return Parse(message=Phenopacket(), text=data), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _parse_phenopackets(items):
+    """Parse JSON bytes into (serialized phenopacket, error) pairs in a worker
+    process, since binary messages are quicker to send back and parse."""
+    res = []
+    for data in items:
+        phenopacket, error = _parse_phenopacket(data)
+        res.append((None if error else phenopacket.SerializeToString(), error))
+    return res
+
+
+_SIMPLE_TYPES = (FieldDescriptor.TYPE_STRING, FieldDescriptor.TYPE_BOOL)
+
+
+def _message_dict(message) -> Dict:
+    """MessageToDict for messages made of strings, bools and nested messages.
+
+    Anything else (repeated fields, numbers, enums, well-known types) goes
+    through MessageToDict, so the result is always the same.
+    """
+    res = {}
+    for field, value in message.ListFields():
+        if field.label == FieldDescriptor.LABEL_REPEATED:
+            return MessageToDict(message)
+        if field.type in _SIMPLE_TYPES:
+            res[field.json_name] = value
+        elif field.type == FieldDescriptor.TYPE_MESSAGE and not (
+            field.message_type.full_name.startswith("google.protobuf.")
+        ):
+            res[field.json_name] = _message_dict(value)
+        else:
+            return MessageToDict(message)
+    return res
+
+
+def _messages(values):
+    return [_message_dict(value) for value in values] if values else np.nan
+
+
 class PhenotypicDatabase:
-    def __init__(self):
-        self.db = {}
+    # Extract each default field from a phenopacket as its JSON value would be,
+    # NaN when the field is unset.
+    _COLUMNS = {
+        "id": lambda p: p.id or np.nan,
+        "phenotypicFeatures": lambda p: _messages(p.phenotypic_features),
+        "genes": lambda p: _messages(p.genes),
+        "diseases": lambda p: _messages(p.diseases),
+        "subject.id": lambda p: p.subject.id or np.nan,
+    }
+
+    def __init__(self, storage: str = None):
+        """
+        :param storage: Path of a SQLite file to keep the phenopackets in,
+            see SqliteStore. By default they are kept in memory.
+        """
+        self.db = {} if storage is None else SqliteStore(storage)
         self.fields = [
             "id",
             "phenotypicFeatures",
@@ -23,52 +136,291 @@ class PhenotypicDatabase:
             "subject.id",
             "hpo terms",
         ]
-        self.patient_sampler = PatientSampler()
+        self._patient_sampler = None
+        self._content_hashes = set()
+        self._term_index = None
+
+    @property
+    def patient_sampler(self) -> PatientSampler:
+        """Patient sampler, built on first use since it loads all resources."""
+        if self._patient_sampler is None:
+            self._patient_sampler = PatientSampler()
+        return self._patient_sampler
+
+    @property
+    def term_index(self) -> TermIndex:
+        """HPO term index of the phenopackets, built on first use and then
+        updated by add_phenopacket."""
+        if self._term_index is None:
+            self._term_index = TermIndex()
+            self._term_index.extend(self.db.values())
+        return self._term_index
+
+    def close(self) -> None:
+        '''Writes pending phenopackets and closes the SQLite storage, if any.'''
+        if isinstance(self.db, SqliteStore):
+            self.db.close()
 
     def add_phenopacket(self, phenopacket: Phenopacket) -> None:
         self.db[phenopacket.id] = phenopacket
+        if self._term_index is not None:
+            self._term_index.add(phenopacket)
+
+    def query(
+        self, all_of: List[str] = (), any_of: List[str] = (), none_of: List[str] = ()
+    ) -> List[str]:
+        '''Ids of the phenopackets with all the terms of all_of, at least one
+        of any_of and none of none_of. A phenopacket has a term when it has
+        the term or any of its descendants as a phenotypic feature.'''
+        return self.term_index.query(all_of, any_of, none_of)
+
+    def query_at_least(self, terms: List[str], k: int) -> List[str]:
+        '''Ids of the phenopackets with at least k of the terms, see query.'''
+        return self.term_index.at_least(terms, k)
 
     def load_from_file(self, file_path: str) -> Phenopacket:
+        '''Parses a phenopacket JSON file. Raises PhenopacketLoadError with
+        the path if it cannot be read or parsed.'''
         try:
             with open(file_path, "r") as jsfile:
                 return Parse(message=Phenopacket(), text=jsfile.read())
         except Exception as e:
-            print(e)
+            raise PhenopacketLoadError(file_path, f"{type(e).__name__}: {e}") from e
+
+    def load_from_folder(
+        self,
+        folder_path: str,
+        workers: int = 1,
+        progress: Callable[[LoadProgress], None] = None,
+        chunk_size: int = 256,
+    ) -> List[LoadError]:
+        '''Loads phenopackets from a directory into the database.
+
+        Files are read and hashed in this process and parsed by chunks, in a
+        pool of worker processes if workers > 1, up to the number of CPUs.
+        Workers send the messages back serialized, which this process still
+        parses in about half the time of the JSON, so the pool at best about
+        halves the load time. Files whose content was
+        already loaded are skipped, so loading a folder again only loads what
+        changed. Returns the files that could not be loaded. The progress
+        callback is called with a LoadProgress after every chunk and at the
+        end.'''
+        paths = sorted(os.path.join(folder_path, file) for file in os.listdir(folder_path))
+        errors = []
+        counts = {"loaded": 0, "skipped": 0}
+        start = time.perf_counter()
+
+        def report():
+            if progress is not None:
+                done = counts["loaded"] + counts["skipped"] + len(errors)
+                progress(
+                    LoadProgress(
+                        done,
+                        len(paths),
+                        counts["loaded"],
+                        counts["skipped"],
+                        len(errors),
+                        time.perf_counter() - start,
+                    )
+                )
 
-    def load_from_folder(self, folder_path: str) -> None:
-        '''Loads phenopackets from a directory into the database.'''
-        for file in os.listdir(folder_path):
-            self.add_phenopacket(self.load_from_file(os.path.join(folder_path, file)))
+        def read_chunks():
+            pending = set()
+            chunk = []
+            for path in paths:
+                try:
+                    with open(path, "rb") as fp:
+                        data = fp.read()
+                except OSError as e:
+                    errors.append(LoadError(path, f"{type(e).__name__}: {e}"))
+                    continue
+                digest = hashlib.sha1(data).hexdigest()
+                if digest in self._content_hashes or digest in pending:
+                    counts["skipped"] += 1
+                    continue
+                pending.add(digest)
+                chunk.append((path, data, digest))
+                if len(chunk) == chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        def add(chunk, results):
+            for (path, _, digest), (phenopacket, error) in zip(chunk, results):
+                if error is not None:
+                    errors.append(LoadError(path, error))
+                    continue
+                if isinstance(phenopacket, bytes):
+                    phenopacket = Phenopacket.FromString(phenopacket)
+                self.add_phenopacket(phenopacket)
+                self._content_hashes.add(digest)
+                counts["loaded"] += 1
+            report()
+
+        workers = min(workers, os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                in_flight = deque()
+                for chunk in read_chunks():
+                    items = [data for _, data, _ in chunk]
+                    in_flight.append(
+                        (chunk, executor.submit(_parse_phenopackets, items))
+                    )
+                    if len(in_flight) >= 2 * workers:
+                        chunk, future = in_flight.popleft()
+                        add(chunk, future.result())
+                while in_flight:
+                    chunk, future = in_flight.popleft()
+                    add(chunk, future.result())
+        else:
+            for chunk in read_chunks():
+                add(chunk, [_parse_phenopacket(data) for _, data, _ in chunk])
+        report()
+        return errors
 
     def generate_list_of_dicts(self, include_hpo_terms: bool = True) -> List[Dict]:
         '''Generates a list of dicts with the data available in the database.'''
         return_list = []
         for k, v in self.db.items():
-            return_list.append(json.loads(MessageToJson(v)))
+            return_list.append(MessageToDict(v))
         if include_hpo_terms:
             self._add_hpo_symptoms(return_list)
         return return_list
 
     def generate_dataframe(
         self, include_hpo_terms: bool = True
-    ) -> pd.core.frame.DataFrame:
-        '''Generates a Pandas dataframe with the data available in the database.'''
-        df = pd.json_normalize(self.generate_list_of_dicts(include_hpo_terms))
-        fields = []
-        df_columns = set(df.columns)
+    ) -> "pd.DataFrame":
+        '''Generates a Pandas dataframe with the data available in the database.
+
+        The default fields are read straight from the protobuf messages into
+        column lists. Other fields fall back to normalizing the JSON dicts.'''
+        import pandas as pd
+
+        if not set(self.fields) <= set(self._COLUMNS) | {"hpo terms"}:
+            df = pd.json_normalize(self.generate_list_of_dicts(include_hpo_terms))
+            fields = []
+            df_columns = set(df.columns)
+            for field in self.fields:
+                if field in df_columns:
+                    fields.append(field)
+            return df[fields]
+
+        # A single pass, since SQLite storage parses the messages on each one.
+        phenopackets = list(self.db.values())
+        columns = {}
         for field in self.fields:
-            if field in df_columns:
-                fields.append(field)
-        return df[fields]
+            if field in self._COLUMNS:
+                column = [self._COLUMNS[field](v) for v in phenopackets]
+            elif include_hpo_terms:
+                column = [
+                    [feature.type.id for feature in v.phenotypic_features]
+                    for v in phenopackets
+                ]
+            else:
+                continue
+            # As with json_normalize, fields missing from every phenopacket
+            # have no column.
+            if any(value is not np.nan for value in column):
+                columns[field] = column
+        return pd.DataFrame(columns)
+
+    def incidence_matrix(self, propagate: bool = False, hpo=None) -> IncidenceMatrix:
+        '''Builds sparse patient by HPO term matrices from the phenopackets.
 
-    def load(self, dataset: str, data_path: str = DATA_PATH) -> None:
-        if not os.path.exists(os.path.join(data_path, dataset)):
-            os.makedirs(os.path.join(data_path, dataset))
+        Rows follow the phenopackets in the database and columns the terms of
+        the HPO ontology in index order, followed by any term not in the
+        ontology. Negated features go to the excluded matrix. With propagate,
+        observed terms are propagated to all their ancestors and excluded
+        terms to all their descendants.'''
+        import scipy.sparse
+
+        if hpo is None:
+            from rarecrowds.utils import registry
+
+            hpo = registry.shared_hpo()
+        columns = list(hpo.items)
+        index = {hp: i for i, hp in enumerate(columns)}
+        n_terms = len(columns)
+        rows = []
+        entries = {False: ([], []), True: ([], [])}
+        for r, phenopacket in enumerate(self.db.values()):
+            rows.append(phenopacket.id)
+            for feature in phenopacket.phenotypic_features:
+                hp = feature.type.id
+                c = index.get(hp)
+                if c is None:
+                    c = index[hp] = len(columns)
+                    columns.append(hp)
+                entry_rows, entry_cols = entries[feature.negated]
+                entry_rows.append(r)
+                entry_cols.append(c)
+
+        shape = (len(rows), len(columns))
+        matrices = []
+        for negated, (entry_rows, entry_cols) in entries.items():
+            entry_rows = np.array(entry_rows, dtype=np.int64)
+            entry_cols = np.array(entry_cols, dtype=np.int64)
+            if propagate:
+                ptr, idx = hpo.closure_csr(ancestors=not negated)
+                known = entry_cols < n_terms
+                owners, related, _ = gather_rows(ptr, idx, entry_cols[known])
+                entry_rows = np.concatenate((entry_rows, entry_rows[known][owners]))
+                entry_cols = np.concatenate((entry_cols, related))
+            matrix = scipy.sparse.csr_matrix(
+                (np.ones(len(entry_rows), dtype=np.int8), (entry_rows, entry_cols)),
+                shape=shape,
+            )
+            matrix.sum_duplicates()
+            matrix.data[:] = 1
+            matrices.append(matrix)
+        return IncidenceMatrix(
+            matrices[0], matrices[1], np.array(rows, dtype=str), np.array(columns, dtype=str)
+        )
+
+    def load(
+        self,
+        dataset: str,
+        data_path: str = DATA_PATH,
+        refresh: bool = False,
+        use_cache: bool = True,
+    ) -> List[LoadError]:
+        '''Loads a dataset into the database, syncing it first.
+
+        The dataset folder is synced with the remote container, which only
+        downloads the files that changed, see download_data. Datasets are
+        cached as one file of binary phenopackets next to that folder. When
+        the cache was built from the synced files, it is loaded instead of
+        parsing the JSON files again. Use refresh to parse them anyway. If
+        the sync fails, a cache of the files synced last time is loaded with
+        a warning. Returns the files that could not be loaded.'''
+        folder = os.path.join(data_path, dataset)
+        manifest = phenopacket_cache.read_manifest(dataset, data_path)
+        cached = use_cache and not refresh
         try:
             download_data(dataset, data_path)
-            self.load_from_folder(os.path.join(data_path, dataset))
         except Exception as e:
-            print(e)
+            if not (cached and phenopacket_cache.is_fresh(manifest, folder)):
+                raise
+            print(f"Warning! Could not sync {dataset}, loading the cached copy: {e}")
+        if cached and phenopacket_cache.is_fresh(manifest, folder):
+            for phenopacket in phenopacket_cache.read_cache(dataset, data_path):
+                self.add_phenopacket(phenopacket)
+            return [LoadError(*error) for error in manifest.get("errors", [])]
+        if not use_cache:
+            return self.load_from_folder(folder)
+        sources = phenopacket_cache.source_checksums(
+            folder, manifest["sources"] if manifest else None
+        )
+        dataset_db = PhenotypicDatabase()
+        errors = dataset_db.load_from_folder(folder)
+        phenopacket_cache.write_cache(
+            dataset, data_path, dataset_db.db.values(), sources, errors
+        )
+        for phenopacket in dataset_db.db.values():
+            self.add_phenopacket(phenopacket)
+        self._content_hashes |= dataset_db._content_hashes
+        return errors
 
     def get_available_datasets(self) -> List[str]:
         '''Get dictionary of available data sources.'''
@@ -83,18 +435,22 @@ class PhenotypicDatabase:
             dictionary["hpo terms"] = hpo_terms
 
     def load_simulated_data(self, **kwargs):
-        '''Loads simulated data into the local database.'''
-        patient_params = kwargs.get("patient_params", "default")
+        '''Loads simulated data into the local database.
+
+        Simulations are consumed one disease at a time, so only the
+        phenopackets end up held in memory. Phenopacket messages are filled
+        in directly instead of being parsed from JSON.'''
+        patient_params = kwargs.get("patient_params", "impre")
         num_patients = kwargs.get("num_patients", 20)
-        try:
-            simulations = self.patient_sampler.sample(
-                patient_params=patient_params, N=num_patients
-            )
-            phenopackets = self.patient_sampler.convert_simulations_to_phenopackets(
-                simulations, num_patients=num_patients
-            )
-            for phen_dict in phenopackets:
-                phenopacket = Parse(message=Phenopacket(), text=json.dumps(phen_dict))
-                self.add_phenopacket(phenopacket)
-        except Exception as e:
-            print(e)
+        seed = kwargs.get("seed")
+        simulations = self.patient_sampler.iter_sample(
+            diseases=kwargs.get("diseases"),
+            patient_params=patient_params,
+            N=num_patients,
+            seed=seed,
+            workers=kwargs.get("workers", 1),
+        )
+        for phenopacket in self.patient_sampler.iter_phenopacket_messages(
+            simulations, num_patients=num_patients, seed=seed
+        ):
+            self.add_phenopacket(phenopacket)
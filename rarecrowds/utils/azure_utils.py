@@ -1,7 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
 import os
-from tqdm import tqdm
-
-from azure.storage.blob import BlobServiceClient
+import tempfile
+import time
+from typing import Dict
 
 from rarecrowds.conf_utils import get_config_value
 
@@ -51,27 +53,156 @@ ALLOWED_CONTAINERS = {
 }
 
 
-def download_data(dataset: str, data_path: str) -> None:
+def _file_mode() -> int:
+    """Mode of new files under the current umask, as open() creates them."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _sync_manifest_path(dataset: str, data_path: str) -> str:
+    # Kept outside the dataset folder so it is not loaded as a phenopacket.
+    return os.path.join(data_path, f"{dataset}.sync.json")
+
+
+def _read_sync_manifest(path: str) -> Dict:
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_sync_manifest(path: str, manifest: Dict, mode: int) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(manifest, fp, indent=1)
+    os.chmod(tmp_path, mode)
+    os.replace(tmp_path, path)
+
+
+def _is_synced(blob: Dict, local: Dict, path: str) -> bool:
+    """Whether the local file is the blob, by ETag when known, else by size."""
+    if not local or not os.path.exists(path):
+        return False
+    if os.path.getsize(path) != blob["size"]:
+        return False
+    if blob.get("etag") and local.get("etag"):
+        return blob["etag"] == local["etag"]
+    return local.get("size") == blob["size"]
+
+
+def _download_blob(container_client, name, path, retries, backoff, mode):
+    """Download a blob through a temporary file renamed into place, with retries.
+
+    mkstemp creates the file readable by its owner only, so it gets mode, that
+    of a file created with open(), before taking the place of path.
+    """
+    for attempt in range(retries + 1):
+        fd, tmp_path = tempfile.mkstemp(prefix=".download-", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as blob_file:
+                container_client.download_blob(name).readinto(blob_file)
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, path)
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def download_data(
+    dataset: str,
+    data_path: str,
+    workers: int = 8,
+    retries: int = 3,
+    backoff: float = 0.5,
+    container_client=None,
+) -> Dict[str, int]:
+    """Sync a dataset container into data_path/dataset.
+
+    Blobs are downloaded concurrently by a bounded thread pool sharing one
+    container client. The ETag and size of every downloaded blob are kept in
+    data_path/<dataset>.sync.json, and blobs that did not change are skipped,
+    so refreshing a dataset only downloads what changed. Files synced before
+    whose blob was deleted are removed. Failed downloads are retried with
+    exponential backoff; blobs still failing raise an OSError once all the
+    others are synced. Any client with the list_blobs and download_blob
+    methods of azure's ContainerClient can be passed as container_client.
+    Returns the number of blobs downloaded, skipped and removed.
+    """
     if dataset not in ALLOWED_CONTAINERS:
         raise Exception(
             f"Invalid dataset type: {dataset} \nOnly allowed datasets are {set(ALLOWED_CONTAINERS)}"
         )
-    try:
+    from tqdm import tqdm
+
+    if container_client is None:
+        from azure.storage.blob import BlobServiceClient
+
         blob_service = BlobServiceClient(
             account_url=get_config_value("AZURE", "ACCOUNT_URL")
         )
         container_client = blob_service.get_container_client(dataset)
-        blob_list = container_client.list_blobs()
-        if not os.path.exists(os.path.join(data_path, dataset)):
-            os.makedirs(os.path.join(data_path, dataset))
-        print(f"Starting download of {dataset}")
-        for blob in tqdm(blob_list):
-            blob_client = container_client.get_blob_client(blob)
-            with open(
-                os.path.join(data_path, dataset, blob["name"]), "wb"
-            ) as blob_file:
-                download_stream = blob_client.download_blob()
-                blob_file.write(download_stream.readall())
-        print(f"Downloaded {dataset}")
-    except Exception as e:
-        print(e)
+
+    folder = os.path.join(data_path, dataset)
+    os.makedirs(folder, exist_ok=True)
+    # The umask is read once here, changing it is not safe in the threads.
+    mode = _file_mode()
+    manifest_path = _sync_manifest_path(dataset, data_path)
+    manifest = _read_sync_manifest(manifest_path)
+
+    blobs = {
+        blob["name"]: {"size": blob["size"], "etag": blob.get("etag")}
+        for blob in container_client.list_blobs()
+    }
+    stats = {"downloaded": 0, "skipped": 0, "removed": 0}
+    for name in set(manifest) - set(blobs):
+        if os.path.exists(os.path.join(folder, name)):
+            os.remove(os.path.join(folder, name))
+        del manifest[name]
+        stats["removed"] += 1
+    pending = []
+    for name, blob in blobs.items():
+        if _is_synced(blob, manifest.get(name), os.path.join(folder, name)):
+            stats["skipped"] += 1
+        else:
+            pending.append(name)
+
+    print(f"Starting download of {dataset}")
+    failed = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                _download_blob,
+                container_client,
+                name,
+                os.path.join(folder, name),
+                retries,
+                backoff,
+                mode,
+            ): name
+            for name in pending
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            name = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed[name] = e
+                manifest.pop(name, None)
+            else:
+                manifest[name] = blobs[name]
+                stats["downloaded"] += 1
+    _write_sync_manifest(manifest_path, manifest, mode)
+    if failed:
+        raise OSError(
+            f"Could not download {len(failed)} blobs of {dataset}: "
+            + "; ".join(f"{name}: {e}" for name, e in sorted(failed.items()))
+        )
+    print(f"Downloaded {dataset}")
+    return stats
@@ -0,0 +1,130 @@
+import numpy as np
+
+_BIT_OFFSETS = np.arange(64)
+
+
+def invert_csr(ptr, idx):
+    """Invert an adjacency given in CSR form, e.g. parents into children."""
+    n = len(ptr) - 1
+    owner = np.repeat(np.arange(n, dtype=np.int32), np.diff(ptr))
+    order = np.argsort(idx, kind="stable")
+    inv_ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(idx, minlength=n), out=inv_ptr[1:])
+    return inv_ptr, owner[order]
+
+
+def _levels(parent_ptr, child_ptr, child_idx):
+    """Group term indices by the length of their longest path from a root."""
+    n = len(parent_ptr) - 1
+    pending = np.diff(parent_ptr).astype(np.int64)
+    frontier = np.flatnonzero(pending == 0)
+    levels = []
+    while len(frontier):
+        levels.append(frontier)
+        _, children, _ = gather_rows(child_ptr, child_idx, frontier)
+        pending -= np.bincount(children, minlength=n)
+        frontier = np.unique(children[pending[children] == 0])
+    if sum(len(level) for level in levels) != n:
+        raise ValueError("The ontology graph contains a cycle")
+    return levels
+
+
+def gather_rows(ptr, idx, nodes):
+    """Return owner positions, neighbours and row lengths for the CSR rows of nodes."""
+    counts = ptr[nodes + 1] - ptr[nodes]
+    starts = np.repeat(ptr[nodes] - np.cumsum(counts) + counts, counts)
+    owners = np.repeat(np.arange(len(nodes)), counts)
+    return owners, idx[starts + np.arange(counts.sum())], counts
+
+
+def _propagate(bits, levels, ptr, idx):
+    """Fill bits[v] with the closure of v following the CSR edges in ptr/idx.
+
+    Levels must be ordered so that every neighbour of a node is processed
+    before the node itself.
+    """
+    for level in levels:
+        owners, neighbours, counts = gather_rows(ptr, idx, level)
+        nodes = level[counts > 0]
+        if not len(nodes):
+            continue
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[counts > 0]
+        bits[nodes] = np.bitwise_or.reduceat(bits[neighbours], starts, axis=0)
+        np.bitwise_or.at(
+            bits,
+            (level[owners], neighbours >> 3),
+            (0x80 >> (neighbours & 7)).astype(np.uint8),
+        )
+
+
+class ClosureIndex:
+    """Full ancestor and descendant closure of a DAG stored as packed bitsets.
+
+    Bit ``j`` of ``ancestors[i]`` is set when term ``j`` is a (transitive)
+    ancestor of term ``i``. ``descendants`` holds the reverse relation.
+    ``depth`` is the length of the longest path in the graph, so any depth
+    limited query with ``depth >= self.depth`` is a full closure query.
+    """
+
+    def __init__(self, ancestors, descendants, depth):
+        self.ancestors = ancestors
+        self.descendants = descendants
+        self.depth = depth
+        self.size = ancestors.shape[0]
+
+    @classmethod
+    def build(cls, parent_ptr, parent_idx):
+        """Build the index from the parent adjacency of every term in CSR form."""
+        parent_ptr = np.asarray(parent_ptr, dtype=np.int64)
+        parent_idx = np.asarray(parent_idx, dtype=np.int64)
+        n = len(parent_ptr) - 1
+        child_ptr, child_idx = invert_csr(parent_ptr, parent_idx)
+        levels = _levels(parent_ptr, child_ptr, child_idx)
+        # Rows are padded to whole 64-bit words so they can be scanned as such.
+        nbytes = (n + 63) // 64 * 8
+        ancestors = np.zeros((n, nbytes), dtype=np.uint8)
+        descendants = np.zeros((n, nbytes), dtype=np.uint8)
+        _propagate(ancestors, levels, parent_ptr, parent_idx)
+        _propagate(descendants, levels[::-1], child_ptr, child_idx.astype(np.int64))
+        return cls(ancestors, descendants, len(levels) - 1)
+
+    def covers(self, depth):
+        """Whether a query limited to depth is answered by the full closure."""
+        return depth <= 0 or depth >= self.depth
+
+    def ancestors_of(self, idx):
+        """Sorted indices of the union of ancestors of the given term indices."""
+        return self._union(self.ancestors, idx)
+
+    def descendants_of(self, idx):
+        """Sorted indices of the union of descendants of the given term indices."""
+        return self._union(self.descendants, idx)
+
+    def to_csr(self, ancestors=True):
+        """Closure of every term as CSR arrays (ptr, idx)."""
+        words = (self.ancestors if ancestors else self.descendants).view(np.uint64)
+        # As in _union, only the non-empty words are unpacked.
+        owners, cols = np.nonzero(words)
+        hits = np.unpackbits(words[owners, cols].view(np.uint8).reshape(-1, 8), axis=1)
+        hits = hits.astype(bool)
+        idx = (cols[:, None] * 64 + _BIT_OFFSETS)[hits].astype(np.int32)
+        counts = np.bincount(owners, weights=hits.sum(axis=1), minlength=self.size)
+        ptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(counts.astype(np.int64), out=ptr[1:])
+        return ptr, idx
+
+    def _union(self, bits, idx):
+        if np.ndim(idx) == 0:
+            row = bits[idx]
+        elif len(idx) == 0:
+            return np.empty(0, dtype=np.int64)
+        elif len(idx) < 8:
+            row = bits[idx[0]]
+            for i in idx[1:]:
+                row = row | bits[i]
+        else:
+            row = np.bitwise_or.reduce(bits[np.asarray(idx)], axis=0)
+        # Only unpack the non-empty words, most closures are very sparse.
+        words = np.flatnonzero(row.view(np.uint64))
+        hits = np.unpackbits(row.reshape(-1, 8)[words], axis=1).astype(bool)
+        return (words[:, None] * 64 + _BIT_OFFSETS)[hits]
@@ -0,0 +1,168 @@
+import os
+from typing import Dict, List
+
+VOCABULARY_FILE = "vocabulary.parquet"
+SHARD_FILE = "cohort-{:05d}.parquet"
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as ex:
+        raise ImportError(
+            "pyarrow is needed to write and read cohorts in Parquet format, "
+            "install it with: pip install rarecrowds[parquet]"
+        ) from ex
+    return pa, pq
+
+
+class CohortWriter:
+    """
+    Write simulated cohorts to Parquet files with one row per patient.
+
+    Columns are disease_id (dictionary encoded), patient (index in the cohort),
+    ageOnset and hpo, the list of HPO terms of the patient as int32 indices in
+    the ontology. Terms that are not in the ontology get indices after the last
+    ontology term. The index to term mapping is written to vocabulary.parquet.
+    Rows are written in row groups as cohorts arrive, and a new shard file is
+    started every diseases_per_shard diseases.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        hpo=None,
+        diseases_per_shard: int = 1000,
+        row_group_size: int = 100000,
+    ):
+        """
+        :param path: Directory to write the shard files and the vocabulary to.
+        :param hpo: HPO ontology. Defaults to the shared Hpo instance.
+        :param diseases_per_shard: Number of diseases written to each shard file.
+        :param row_group_size: Number of patients buffered before writing a row group.
+        """
+        from rarecrowds.utils import registry
+
+        self.pa, self.pq = _pyarrow()
+        self.path = path
+        self.hpo = hpo or registry.shared_hpo()
+        self.diseases_per_shard = diseases_per_shard
+        self.row_group_size = row_group_size
+        self.schema = self.pa.schema(
+            [
+                ("disease_id", self.pa.dictionary(self.pa.int32(), self.pa.string())),
+                ("patient", self.pa.int32()),
+                ("ageOnset", self.pa.float64()),
+                ("hpo", self.pa.list_(self.pa.int32())),
+            ]
+        )
+        self.vocabulary = list(self.hpo.items)
+        self._index = {hp: i for i, hp in enumerate(self.vocabulary)}
+        self.files = []
+        self._writer = None
+        self._shard_diseases = 0
+        self._reset_buffer()
+        os.makedirs(path, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _reset_buffer(self):
+        self._diseases = []
+        self._patients = []
+        self._ages = []
+        self._offsets = [0]
+        self._terms = []
+
+    def _term_index(self, hp: str) -> int:
+        i = self._index.get(hp)
+        if i is None:
+            i = self._index[hp] = len(self.vocabulary)
+            self.vocabulary.append(hp)
+        return i
+
+    def write(self, simulations) -> None:
+        """Write simulations as returned by sample, or the pairs yielded by iter_sample."""
+        if isinstance(simulations, dict):
+            simulations = simulations.items()
+        for d, simulation in simulations:
+            self.write_simulation(d, simulation)
+
+    def write_simulation(self, d: str, simulation: Dict) -> None:
+        """Write the cohort of a single disease."""
+        if not simulation:
+            return
+        if self._shard_diseases == self.diseases_per_shard:
+            self._close_shard()
+        for i, patient in enumerate(simulation["cohort"]):
+            self._diseases.append(d)
+            self._patients.append(i)
+            self._ages.append(patient["ageOnset"])
+            for hp in patient["phenotype"] or []:
+                self._terms.append(self._term_index(hp))
+            self._offsets.append(len(self._terms))
+        self._shard_diseases += 1
+        if len(self._patients) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._patients:
+            return
+        pa = self.pa
+        if self._writer is None:
+            filename = os.path.join(self.path, SHARD_FILE.format(len(self.files)))
+            self._writer = self.pq.ParquetWriter(filename, self.schema)
+            self.files.append(filename)
+        table = pa.Table.from_arrays(
+            [
+                pa.array(self._diseases).dictionary_encode(),
+                pa.array(self._patients, pa.int32()),
+                pa.array(self._ages, pa.float64()),
+                pa.ListArray.from_arrays(
+                    pa.array(self._offsets, pa.int32()),
+                    pa.array(self._terms, pa.int32()),
+                ),
+            ],
+            schema=self.schema,
+        )
+        self._writer.write_table(table)
+        self._reset_buffer()
+
+    def _close_shard(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._shard_diseases = 0
+
+    def close(self) -> None:
+        """Write pending rows, close the current shard and write the vocabulary."""
+        self._close_shard()
+        vocabulary = self.pa.table(
+            {
+                "index": self.pa.array(range(len(self.vocabulary)), self.pa.int32()),
+                "hpo": self.pa.array(self.vocabulary, self.pa.string()),
+            }
+        )
+        self.pq.write_table(vocabulary, os.path.join(self.path, VOCABULARY_FILE))
+
+
+def read_vocabulary(path: str) -> List[str]:
+    """HPO term of every index used in the hpo column of a cohort directory."""
+    pa, pq = _pyarrow()
+    return pq.read_table(os.path.join(path, VOCABULARY_FILE))["hpo"].to_pylist()
+
+
+def read_cohorts(path: str, columns: List[str] = None):
+    """Read all the shards of a cohort directory into one pyarrow Table."""
+    pa, pq = _pyarrow()
+    files = sorted(
+        os.path.join(path, f)
+        for f in os.listdir(path)
+        if f.startswith("cohort-") and f.endswith(".parquet")
+    )
+    return pa.concat_tables(pq.read_table(f, columns=columns) for f in files)
@@ -1,9 +1,12 @@
+import copy
 import os
 import re
 import pickle
-import pandas as pd
 from typing import Dict, List
 
+import numpy as np
+
+from rarecrowds.utils import information_content, registry
 from rarecrowds.utils.mondo import Mondo
 from rarecrowds.utils.hpoa import Hpoa
 from rarecrowds.utils.orpha import Orpha
@@ -24,15 +27,19 @@ class DiseaseAnnotations:
         If filepath is not provided, load pickle data.
         Alternatively, load HPOA data file (tsv).
         """
-        orpha = Orpha(reload=reload_orpha)
-        hpoa = Hpoa(reload=reload_hpoa)
-        mondo = Mondo(update=reload_mondo)  # Used to link Orpha and OMIM
+        # Unless reloaded, the sources are the process-wide shared instances.
+        orpha = Orpha(reload=True) if reload_orpha else registry.shared_orpha()
+        hpoa = Hpoa(reload=True) if reload_hpoa else registry.shared_hpoa()
+        # Used to link Orpha and OMIM
+        mondo = Mondo(update=True) if reload_mondo else registry.shared_mondo()
+        self.mode = mode
+        self._ic = {}
         if mode == "intersect":
             self.data = self.__getIntersection(orpha, hpoa, mondo)
         elif mode == "orpha":
             self.data = orpha.data
         elif mode == "hpoa":
-            self.data == hpoa.data
+            self.data = hpoa.data
 
     def __getIntersection(self, orpha, hpoa, mondo):
         """
@@ -48,7 +55,8 @@ class DiseaseAnnotations:
             omims = [i for i in xrefs if "OMIM" in i.upper()]
             if omims:
                 # print(orphaid, orphadis['phenotype'])
-                data[orphaid] = orphadis
+                # Copy, the Orpha data may be shared with other instances.
+                data[orphaid] = copy.deepcopy(orphadis)
                 omim_phen = {}
                 for omimid in omims:
                     # GET PHENOTYPE DATA
@@ -89,6 +97,26 @@ class DiseaseAnnotations:
 
         return data
 
+    def annotations(self, hpo=None) -> information_content.Annotations:
+        """Disease to HPO term annotations as index arrays, see annotation_arrays."""
+        hpo = hpo or registry.shared_hpo()
+        return information_content.annotation_arrays(hpo, self.data)
+
+    def information_content(self, hpo=None) -> np.ndarray:
+        """
+        Information content of every HPO term, indexed as the ontology terms.
+        Computed from the frequency of the terms, ancestors included, among
+        the annotated diseases. It is stored next to the ontology snapshot
+        and only computed again when the ontology or the annotations change.
+        """
+        hpo = hpo or registry.shared_hpo()
+        key = (id(hpo), hpo.digest)
+        if key not in self._ic:
+            self._ic[key] = information_content.load_ic(
+                hpo, self.annotations(hpo), information_content.ic_path(hpo, self.mode)
+            )
+        return self._ic[key]
+
     def __getitem__(self, disease: str) -> List[str]:
         """Get disease data."""
         try:
@@ -1,27 +1,33 @@
 import os
-import networkx as nx
-import plotly.graph_objects as go
 from typing import List, Dict
 
+from rarecrowds.utils import registry
 from rarecrowds.utils.ontograph import OntoGraph
 
 
 class Hpo(OntoGraph):
     """Class to load the HPO ontology and plot HPO set differences."""
 
-    def __init__(self, filename=None, update=False):
+    _CACHE_CLOSURE = True
+
+    def __init__(self, filename=None, update=False, closure=True):
         self.purl = "http://purl.obolibrary.org/obo/hp.obo"
         _data_path = os.path.join(os.path.dirname(__file__), "resources")
         _pkl_path = os.path.join(_data_path, "hp.pkl")
+        _snapshot_path = registry.cache_path("hp.snap")
         if update:
             filename = self.purl
             if filename:
                 print(f"Warning! 'filename' is repalced by '{self.purl}'")
-        elif not filename:
-            filename = _pkl_path
-        super().__init__(filename)
+        if filename:
+            super().__init__(filename, closure=closure)
+        else:
+            super().__init__(_pkl_path, closure=closure, snapshot=_snapshot_path)
         if update:
-            super().save(_pkl_path)
+            self.save_pickle(_pkl_path)
+            if self.closure is None:
+                self.build_closure()
+            self._cache_snapshot(_snapshot_path, _pkl_path)
 
     def _add_node(self, G, id, term):
         # G.add_node(id, name=term.name, desc=str(term.definition), comment=self._parse_comment(term), synonyms=self._parse_synonyms(term))
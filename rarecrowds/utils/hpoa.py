@@ -1,8 +1,16 @@
 import os
 import pickle
-import pandas as pd
 from typing import Dict, List
 
+from rarecrowds.utils import registry
+
+
+def _notna(value) -> bool:
+    """pandas.notna of a cell of the HPOA table, which is a string or NaN.
+
+    Called for every row, so it does not import pandas each time."""
+    return value is not None and value == value
+
 
 class Hpoa:
     """Read data from HPOA file or stored pickle file."""
@@ -38,6 +46,8 @@ class Hpoa:
         """
         Load HPOA file provided through the constructor method.
         """
+        import pandas as pd
+
         d = {}
         df = pd.read_csv(filename, header=4, sep="\t")
         gb = df.groupby(["#DatabaseID"])
@@ -94,7 +104,7 @@ class Hpoa:
         d[field].setdefault(hp, {})
         # Add modifiers
         for col in ["frequency", "modifier", "onset", "sex"]:
-            if pd.notna(row[col]):
+            if _notna(row[col]):
                 d[field][hp][col] = row[col]
         return d
 
@@ -102,7 +112,7 @@ class Hpoa:
     def __add_disease_annotation(d, field, row):
         d.setdefault(field, [])
         d[field].append(row["HPO_ID"])
-        if pd.notna(row["Modifier"]):
+        if _notna(row["Modifier"]):
             d[field].append(row["Modifier"])
         return d
 
@@ -141,3 +151,4 @@ class Hpoa:
         """Store HPOA file in pickle file."""
         with open(path, "wb") as fp:
             pickle.dump(self.data, fp)
+        registry.invalidate(path)
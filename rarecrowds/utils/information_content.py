@@ -0,0 +1,112 @@
+import hashlib
+import os
+from typing import Dict, NamedTuple
+
+import numpy as np
+
+from rarecrowds.utils import registry
+from rarecrowds.utils.closure import gather_rows
+from rarecrowds.utils.snapshot import is_snapshot, read_snapshot, write_snapshot
+
+VERSION = 1
+# Frequency of the symptoms a disease is known not to have.
+EXCLUDED = "HP:0040285"
+
+
+class Annotations(NamedTuple):
+    """Disease to HPO term annotations as parallel index arrays."""
+
+    diseases: list
+    disease: np.ndarray
+    term: np.ndarray
+    digest: str
+
+
+def annotation_arrays(hpo, data: Dict) -> Annotations:
+    """Index arrays of the (disease, term) annotations of a disease catalogue.
+
+    data maps disease ids to dicts with a phenotype dict keyed by HPO term, as
+    in DiseaseAnnotations.data. Diseases are sorted by id. Symptoms with the
+    excluded frequency and terms not in the ontology are left out. The digest
+    identifies the annotations, it changes whenever any of them does.
+    """
+    diseases = sorted(data)
+    owners = []
+    terms = []
+    digest = hashlib.sha1()
+    for d, disease in enumerate(diseases):
+        phenotype = (data[disease] or {}).get("phenotype") or {}
+        hpos = sorted(
+            hp
+            for hp, symptom in phenotype.items()
+            if (symptom or {}).get("frequency") != EXCLUDED
+        )
+        digest.update(f"{disease}\t{' '.join(hpos)}\n".encode())
+        owners.extend([d] * len(hpos))
+        terms.extend(hpos)
+    cols = hpo.indices(terms)
+    known = cols >= 0
+    return Annotations(
+        diseases,
+        np.array(owners, dtype=np.int64)[known],
+        cols[known],
+        digest.hexdigest(),
+    )
+
+
+def propagate(hpo, disease: np.ndarray, term: np.ndarray):
+    """Annotations plus those to every ancestor of the terms, without repeats."""
+    owners, ancestors, _ = gather_rows(*hpo.closure_csr(ancestors=True), term)
+    n = len(hpo.items)
+    pairs = np.concatenate((disease * n + term, disease[owners] * n + ancestors))
+    pairs = np.sort(pairs)
+    if len(pairs):
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+    return pairs // n, pairs % n
+
+
+def compute_ic(hpo, annotations: Annotations) -> np.ndarray:
+    """Information content -log(p) of every term of the ontology, in index order.
+
+    p is the fraction of the annotated diseases annotated with the term or
+    any of its descendants. Terms without annotations get the largest IC,
+    that of a term annotated to a single disease.
+    """
+    disease, term = propagate(hpo, annotations.disease, annotations.term)
+    counts = np.bincount(term, minlength=len(hpo.items))
+    total = max(len(np.unique(disease)), 1)
+    with np.errstate(divide="ignore"):
+        ic = np.log(total) - np.log(counts)
+    ic[counts == 0] = np.log(total)
+    return ic
+
+
+def ic_path(hpo, mode: str) -> str:
+    """Where the IC of the mode annotations is stored, in the user cache
+    directory, named after the ontology snapshot."""
+    if hpo._snapshot is None:
+        return None
+    name = os.path.splitext(os.path.basename(hpo._snapshot))[0]
+    return registry.cache_path(f"{name}.ic-{mode}.snap")
+
+
+def load_ic(hpo, annotations: Annotations, path: str = None) -> np.ndarray:
+    """IC of every HPO term, read from path if it was computed from the same
+    ontology and annotations, otherwise computed and written to path."""
+    meta = {"version": VERSION, "hpo": hpo.digest, "annotations": annotations.digest}
+    if path is not None and is_snapshot(path):
+        try:
+            arrays, stored, _ = read_snapshot(path)
+        except ValueError:
+            stored = None
+        if stored == meta:
+            return arrays["ic"]
+    ic = compute_ic(hpo, annotations)
+    if path is not None and hpo.digest is not None:
+        # Nothing is written if path is not writable, as with ontology snapshots.
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            write_snapshot(path, {"ic": ic}, meta)
+        except OSError:
+            pass
+    return ic
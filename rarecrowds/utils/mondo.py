@@ -1,36 +1,76 @@
 import os
 import pickle
-import networkx as nx
+import numpy as np
 
+from rarecrowds.utils import registry
 from rarecrowds.utils.ontograph import OntoGraph
 
 
 class Mondo(OntoGraph):
     """Class to load the MONDO ontology."""
 
+    _MAPPED = OntoGraph._MAPPED + ("_mapping", "_xrefs", "_meta_blob")
+
     def __init__(self, filename=None, update=False):
-        self.mapping = {}
-        self.xrefs = {}
+        self._mapping = {}
+        self._xrefs = {}
+        self._meta_blob = None
         self.purl = "http://purl.obolibrary.org/obo/mondo.obo"
         _data_path = os.path.join(os.path.dirname(__file__), "resources")
         _pkl_path = os.path.join(_data_path, "mondo.obo.pkl")
+        _snapshot_path = registry.cache_path("mondo.snap")
         if update:
             if filename:
                 print(f"Warning! 'filename' is replaced by '{self.purl}'")
             filename = self.purl
-        elif not filename:
-            filename = _pkl_path
-        super().__init__(filename)
+        if filename:
+            super().__init__(filename)
+        else:
+            super().__init__(_pkl_path, snapshot=_snapshot_path)
         if update:
-            self.save(_pkl_path)
+            self.save_pickle(_pkl_path)
+            self._cache_snapshot(_snapshot_path, _pkl_path)
+
+    @property
+    def mapping(self):
+        self._unpack_meta()
+        return self._mapping
+
+    @property
+    def xrefs(self):
+        self._unpack_meta()
+        return self._xrefs
+
+    def _unpack_meta(self):
+        """Unpickle the cross-reference tables of a snapshot on first use."""
+        if self._meta_blob is not None:
+            meta = pickle.loads(self._meta_blob.tobytes())
+            self._mapping = meta["mapping"]
+            self._xrefs = meta["xrefs"]
+            self._meta_blob = None
 
     def _load_graph(self, filename):
         with open(filename, "rb") as fp:
             meta = pickle.load(fp)
-        self.mapping = meta["mapping"]
-        self.xrefs = meta["xrefs"]
+        self._mapping = meta["mapping"]
+        self._xrefs = meta["xrefs"]
         return meta["graph"]
 
+    def save_pickle(self, path):
+        with open(path, "wb") as fp:
+            pickle.dump(
+                {"mapping": self.mapping, "xrefs": self.xrefs, "graph": self.Graph}, fp
+            )
+
+    def _load_snapshot_extra(self, arrays, meta):
+        self._mapping = {}
+        self._xrefs = {}
+        self._meta_blob = arrays["mondo_meta"]
+
+    def _save_snapshot_extra(self, arrays, meta):
+        blob = pickle.dumps({"mapping": self.mapping, "xrefs": self.xrefs})
+        arrays["mondo_meta"] = np.frombuffer(blob, dtype=np.uint8)
+
     def _add_node(self, G, id, term):
         self.mapping[id] = id
         if not id in self.xrefs:
@@ -61,9 +101,3 @@ class Mondo(OntoGraph):
             if id:
                 items.append(id)
         return items
-
-    def save(self, path):
-        """Save current class data as a dict."""
-        meta = {"graph": self.Graph, "mapping": self.mapping, "xrefs": self.xrefs}
-        with open(path, "wb") as fp:
-            pickle.dump(meta, fp)
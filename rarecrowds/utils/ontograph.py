@@ -1,27 +1,201 @@
 import os
 import json
 import pickle
-import networkx as nx
-import networkx.readwrite.json_graph as js
+from collections.abc import Mapping
+import numpy as np
 
-from pronto import Ontology
+from rarecrowds.utils import registry
+from rarecrowds.utils.closure import ClosureIndex, invert_csr
+from rarecrowds.utils.snapshot import is_snapshot, read_snapshot, write_snapshot
+
+
+class TermView(Mapping):
+    """Read-only mapping of term ids to their attributes."""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, id):
+        return self._graph._node(self._graph._index[id])
+
+    def __iter__(self):
+        return iter(self._graph._terms)
+
+    def __len__(self):
+        return len(self._graph._terms)
+
+    def __contains__(self, id):
+        return id in self._graph._index
+
+    def __call__(self, data=False):
+        if data:
+            return self.items()
+        return self
+
+
+def _file_version(path):
+    """Size and modification time of a file, None if it cannot be read."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
 
 
 class OntoGraph:
-    def __init__(self, filename):
-        if filename.lower()[-4:] == ".pkl":
-            self.Graph = self._load_graph(filename)
+    """Ontology stored as integer-indexed CSR adjacency arrays.
+
+    Terms are sorted by id and addressed by their position. Parents and
+    children of term ``i`` are ``parent_idx[parent_ptr[i]:parent_ptr[i + 1]]``
+    and ``child_idx[child_ptr[i]:child_ptr[i + 1]]``. Labels are kept in one
+    packed UTF-8 table indexed by ``label_ptr``.
+    """
+
+    _ARRAYS = (
+        "ids",
+        "parent_ptr",
+        "parent_idx",
+        "child_ptr",
+        "child_idx",
+        "label_ptr",
+        "label_data",
+    )
+    # Attributes restored from the snapshot file when unpickling.
+    _MAPPED = _ARRAYS + (
+        "_attrs",
+        "closure",
+        "_closure_cache",
+        "_closure_csr",
+        "_terms",
+        "_index",
+    )
+
+    # Whether snapshots cached by _cache_snapshot include the closure index.
+    _CACHE_CLOSURE = False
+
+    def __init__(self, filename, closure=False, snapshot=None):
+        """
+        :param filename: Snapshot, pickled graph or OBO file (path or URL).
+        :param closure: Whether to build the closure index.
+        :param snapshot: Where to cache a snapshot of a pickled graph. It is
+            opened instead of filename while filename is unchanged.
+        """
+        self.closure = None
+        self.digest = None
+        self._snapshot = None
+        if snapshot is not None and self._open_cached(snapshot, filename):
+            pass
+        elif snapshot is not None:
+            self._from_graph(self._load_graph(filename))
+            if self._CACHE_CLOSURE:
+                self.build_closure()
+            self._cache_snapshot(snapshot, filename)
+        elif is_snapshot(filename):
+            self._open(filename)
+        elif filename.lower()[-4:] == ".pkl":
+            self._from_graph(self._load_graph(filename))
         else:
-            self.Graph = self._build_graph(Ontology(filename))
-            _data_path = os.path.join(os.path.dirname(__file__), "_data")
-            _pkl_file = os.path.join(_data_path, "hp.pkl")
-            self.save(_pkl_file)
-        self.root = [nd for nd, d in self.Graph.in_degree() if d == 0][0]
+            from pronto import Ontology
+
+            self._from_graph(self._build_graph(Ontology(filename)))
+        if closure and self.closure is None:
+            self.build_closure()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_graph"] = None
+        if self._snapshot is not None:
+            # Reopen the shared mapping instead of copying the arrays around.
+            for name in self._MAPPED:
+                state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._snapshot is not None:
+            self._open(self._snapshot)
 
     def _load_graph(self, filename):
-        return nx.read_gpickle(filename)
+        # nx.read_gpickle is gone in networkx 3, the file is a plain pickle.
+        with open(filename, "rb") as fp:
+            return pickle.load(fp)
+
+    def _open_cached(self, snapshot, source):
+        """Open snapshot if it was cached from the current version of source."""
+        try:
+            _, meta, _ = read_snapshot(snapshot)
+        except (OSError, ValueError):
+            return False
+        version = _file_version(source)
+        if version is None or meta.get("source") != version:
+            return False
+        self._open(snapshot)
+        return True
+
+    def _open(self, filename):
+        """Memory-map an ontology snapshot written by save."""
+        arrays, meta, self.digest = read_snapshot(filename)
+        for name in self._ARRAYS:
+            setattr(self, name, arrays[name])
+        self._attrs = {}
+        if "attrs" in arrays:
+            self._attrs = pickle.loads(arrays["attrs"].tobytes())
+        if "closure_ancestors" in arrays:
+            self.closure = ClosureIndex(
+                arrays["closure_ancestors"],
+                arrays["closure_descendants"],
+                meta["closure_depth"],
+            )
+            self._closure_cache = {}
+        self._closure_csr = {}
+        self._load_snapshot_extra(arrays, meta)
+        self._snapshot = filename
+        self._init_lookups()
+
+    def _load_snapshot_extra(self, arrays, meta):
+        """Hook for subclasses storing additional sections in the snapshot."""
+
+    def _save_snapshot_extra(self, arrays, meta):
+        """Hook for subclasses storing additional sections in the snapshot."""
+
+    def _from_graph(self, G):
+        """Compile a networkx graph into the array representation."""
+        ids = sorted(G.nodes)
+        index = {id: i for i, id in enumerate(ids)}
+        n = len(ids)
+        edges = np.array(
+            [(index[u], index[v]) for u, v in G.edges], dtype=np.int32
+        ).reshape(-1, 2)
+        edges = edges[np.lexsort((edges[:, 0], edges[:, 1]))]
+        self.parent_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges[:, 1], minlength=n), out=self.parent_ptr[1:])
+        self.parent_idx = edges[:, 0].copy()
+        self.child_ptr, self.child_idx = invert_csr(self.parent_ptr, self.parent_idx)
+
+        self.ids = np.array([id.encode() for id in ids])
+        labels = [(G.nodes[id].get("label") or "").encode() for id in ids]
+        self.label_ptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(label) for label in labels], out=self.label_ptr[1:])
+        self.label_data = np.frombuffer(b"".join(labels), dtype=np.uint8)
+
+        self._attrs = {}
+        for i, id in enumerate(ids):
+            extra = {k: v for k, v in G.nodes[id].items() if k not in ("id", "label")}
+            if extra:
+                self._attrs[i] = extra
+        self._init_lookups()
+
+    def _init_lookups(self):
+        self._terms = [id.decode() for id in self.ids.tolist()]
+        self._index = {id: i for i, id in enumerate(self._terms)}
+        self._graph = None
+        roots = np.flatnonzero(np.diff(self.parent_ptr) == 0)
+        n_children = np.diff(self.child_ptr)[roots]
+        self.root = self._terms[roots[np.argmax(n_children)]]
 
     def _build_graph(self, ontology):
+        import networkx as nx
+
         G = nx.DiGraph()
         for id in ontology:
             term = ontology[id]
@@ -59,71 +233,201 @@ class OntoGraph:
             syns.append(syn)
         return syns
 
+    def build_closure(self):
+        """Precompute the full ancestor and descendant sets of every term.
+
+        Full depth successors/predecessors queries are then answered from
+        the bitset index instead of walking the graph.
+        """
+        self.closure = ClosureIndex.build(self.parent_ptr, self.parent_idx)
+        self._closure_cache = {}
+        self._closure_csr = {}
+
+    @property
+    def Graph(self):
+        """networkx view of the ontology, built on first access."""
+        if self._graph is None:
+            import networkx as nx
+
+            G = nx.DiGraph()
+            G.add_nodes_from((id, self._node(i)) for i, id in enumerate(self._terms))
+            child_of = np.repeat(np.arange(len(self._terms)), np.diff(self.parent_ptr))
+            G.add_edges_from(
+                (self._terms[p], self._terms[c])
+                for p, c in zip(self.parent_idx.tolist(), child_of.tolist())
+            )
+            self._graph = G
+        return self._graph
+
+    def label(self, i):
+        """Label of the term at index i."""
+        return (
+            self.label_data[self.label_ptr[i] : self.label_ptr[i + 1]]
+            .tobytes()
+            .decode()
+        )
+
+    def _node(self, i):
+        node = {"id": self._terms[i], "label": self.label(i)}
+        node.update(self._attrs.get(i, {}))
+        return node
+
     @property
     def items(self):
-        return self.Graph.nodes
+        return TermView(self)
 
     def __getitem__(self, id):
         try:
             id = id.upper()
-            return self.Graph.nodes[id]
+            return self._node(self._index[id])
         except:
             return None
 
-    def save(self, path):
-        nx.write_gpickle(self.Graph, path)
+    def save(self, path, source=None):
+        """Write the ontology, and its closure index if built, to a snapshot.
+
+        The snapshot is a versioned binary file that is memory-mapped on
+        load, see rarecrowds.utils.snapshot. The size and modification time
+        of the source file, if given, are recorded to tell stale caches.
+        """
+        arrays = {name: getattr(self, name) for name in self._ARRAYS}
+        meta = {"class": type(self).__name__}
+        if source is not None:
+            meta["source"] = _file_version(source)
+        if self._attrs:
+            arrays["attrs"] = np.frombuffer(pickle.dumps(self._attrs), dtype=np.uint8)
+        if self.closure is not None:
+            arrays["closure_ancestors"] = self.closure.ancestors
+            arrays["closure_descendants"] = self.closure.descendants
+            meta["closure_depth"] = self.closure.depth
+        self._save_snapshot_extra(arrays, meta)
+        self.digest = write_snapshot(path, arrays, meta)
+
+    def save_pickle(self, path):
+        """Write the ontology as the pickled graph read by _load_graph."""
+        with open(path, "wb") as fp:
+            pickle.dump(self.Graph, fp)
+
+    def _cache_snapshot(self, path, source):
+        """Write a snapshot of source for faster loading next time, and treat
+        the ontology as opened from it, as it will be by other processes.
+        Nothing is written if path is not writable, the ontology still works."""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.save(path, source)
+        except OSError:
+            return
+        self._snapshot = path
+        registry.invalidate(path)
 
     def save_json(self, filename):
         with open(filename, "w") as fp:
             fp.write(self.json())
 
     def json(self):
+        import networkx.readwrite.json_graph as js
+
         g = js.node_link_data(self.Graph)
         return json.dumps(g)
 
     def json_adjacency(self):
+        import networkx.readwrite.json_graph as js
+
         g = js.adjacency_data(self.Graph)
         return json.dumps(g)
 
     def successors(self, ids, depth=1):
         if not type(ids) is list:
             ids = [ids]
-        items = set()
         for id in ids:
-            for item in self._successors(id, depth):
-                items.add(item)
-        res = list(items)
-        res.sort()
-        return res
-
-    def _successors(self, id, depth):
-        depth -= 1
-        items = set()
-        for item in self.Graph.successors(id):
-            items.add(item)
-            if depth != 0:
-                for it in self._successors(item, depth):
-                    items.add(it)
-        return items
+            if id not in self._index:
+                raise KeyError(f"The node {id} is not in the ontology.")
+        return self._related(ids, depth, ancestors=False)
 
     def predecessors(self, ids, depth=1):
         if not type(ids) is list:
             ids = [ids]
+        ids = [id for id in ids if id in self._index]
+        return self._related(ids, depth, ancestors=True)
+
+    def indices(self, ids):
+        """Index of every term id in the ontology arrays, -1 for unknown ids."""
+        return np.array([self._index.get(id, -1) for id in ids], dtype=np.int64)
+
+    def closure_csr(self, ancestors=True):
+        """Full ancestors (or descendants) of every term as CSR arrays (ptr, idx).
+
+        Built from the closure index on first use and kept in memory.
+        """
+        if self.closure is None:
+            self.build_closure()
+        key = "ancestors" if ancestors else "descendants"
+        if key not in self._closure_csr:
+            self._closure_csr[key] = self.closure.to_csr(ancestors)
+        return self._closure_csr[key]
+
+    def ancestor_distances(self, id):
+        """Smallest number of steps from id up to each of its ancestors."""
+        if id not in self._index:
+            return {}
+        dist = {}
+        frontier = [self._index[id]]
+        step = 0
+        while frontier:
+            step += 1
+            reached = set()
+            for i in frontier:
+                reached.update(
+                    self.parent_idx[self.parent_ptr[i] : self.parent_ptr[i + 1]].tolist()
+                )
+            frontier = [i for i in reached if i not in dist]
+            for i in frontier:
+                dist[i] = step
+        return {self._terms[i]: d for i, d in dist.items()}
+
+    def _related(self, ids, depth, ancestors):
+        if self.closure is None or not self.closure.covers(depth):
+            if ancestors:
+                res = self._walk(ids, depth, self.parent_ptr, self.parent_idx)
+            else:
+                res = self._walk(ids, depth, self.child_ptr, self.child_idx)
+            return [self._terms[i] for i in res]
+        if len(ids) == 1:
+            return list(self._closure_terms(self._index[ids[0]], ancestors))
         items = set()
         for id in ids:
-            for item in self._predecessors(id, depth):
-                items.add(item)
+            items.update(self._closure_terms(self._index[id], ancestors))
         res = list(items)
         res.sort()
         return res
 
-    def _predecessors(self, id, depth):
-        depth -= 1
-        items = set()
-        if self.Graph.has_node(id):
-            for item in self.Graph.predecessors(id):
-                items.add(item)
-                if depth != 0:
-                    for it in self._predecessors(item, depth):
-                        items.add(it)
-        return items
+    def _closure_terms(self, i, ancestors):
+        """Sorted closure of a single term, memoized as a tuple of ids."""
+        key = i if ancestors else -i - 1
+        res = self._closure_cache.get(key)
+        if res is None:
+            if ancestors:
+                res = self.closure.ancestors_of(i)
+            else:
+                res = self.closure.descendants_of(i)
+            res = tuple(self._terms[j] for j in res)
+            self._closure_cache[key] = res
+        return res
+
+    def _walk(self, ids, depth, ptr, idx):
+        """Sorted indices of terms reachable from ids within depth steps."""
+        seen = set()
+        frontier = {self._index[id] for id in ids}
+        while frontier:
+            reached = set()
+            for i in frontier:
+                reached.update(idx[ptr[i] : ptr[i + 1]].tolist())
+            frontier = reached - seen
+            seen |= frontier
+            # As in a recursive walk, depth <= 0 means no depth limit.
+            depth -= 1
+            if depth == 0:
+                break
+        res = list(seen)
+        res.sort()
+        return res
@@ -3,6 +3,8 @@ import pickle
 from typing import Dict, List
 import xml.etree.ElementTree as ET
 
+from rarecrowds.utils import registry
+
 
 def _read_node(node):
     d = {}
@@ -254,3 +256,4 @@ class Orpha:
         """Store orphanet's aggregated data in pickle file."""
         with open(path, "wb") as fp:
             pickle.dump(self.data, fp)
+        registry.invalidate(path)
@@ -1,10 +1,35 @@
+import bisect
+from collections import deque
+import copy
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+import hashlib
 import numpy as np
-from typing import Dict, List
-import uuid
+from typing import TYPE_CHECKING, Dict, Iterator, List, NamedTuple, Tuple
 
-from rarecrowds.utils.disease_annotations import DiseaseAnnotations
-from rarecrowds.utils.hpo import Hpo
+from rarecrowds.utils import registry
+from rarecrowds.utils.sampling import as_weights, sample_complement
+
+if TYPE_CHECKING:
+    from rarecrowds.phenopackets_pb2 import Phenopacket
+
+_worker_sampler = None
+_worker_settings = None
+
+PHENOPACKET_METADATA = {
+    "submittedBy": "patient sampler",
+    "resources": [
+        {
+            "id": "hp",
+            "name": "human phenotype ontology",
+            "url": "http://purl.obolibrary.org/obo/hp.owl",
+            "version": "",
+            "namespacePrefix": "HP",
+            "iriPrefix": "http://purl.obolibrary.org/obo/HP_",
+        }
+    ],
+}
 
 
 def build_eligibles(phen_data, hpo_data) -> List[str]:
@@ -19,16 +44,161 @@ def build_eligibles(phen_data, hpo_data) -> List[str]:
     return items
 
 
+def annotation_frequency(phen_data, terms: List[str]) -> np.ndarray:
+    """Number of diseases annotated with each of the terms."""
+    counts = dict.fromkeys(terms, 0)
+    for disease in phen_data.values():
+        for hp in disease.get("phenotype", {}):
+            if hp in counts:
+                counts[hp] += 1
+    return np.array([counts[hp] for hp in terms], dtype=float)
+
+
+def random_ids(rng, n: int) -> List[str]:
+    """n random ids of 32 hex digits, like uuid4().hex, drawn from rng."""
+    digits = rng.bytes(16 * n).hex()
+    return [digits[i : i + 32] for i in range(0, 32 * n, 32)]
+
+
+@lru_cache(maxsize=None)
+def _metadata_template():
+    from google.protobuf.json_format import ParseDict
+    from rarecrowds.base_pb2 import MetaData
+
+    return ParseDict(PHENOPACKET_METADATA, MetaData())
+
+
+def disease_rng(entropy, disease_id: str, stream: int = 0) -> np.random.Generator:
+    """
+    Random generator of a disease, independent of which other diseases are sampled
+    and in which order or process. It is the child of SeedSequence(entropy) whose
+    spawn key is derived from the disease id, instead of the spawn counter. Other
+    streams give independent generators of the same disease for other uses.
+    """
+    key = hashlib.blake2b(disease_id.encode(), digest_size=8).digest()
+    spawn_key = (int.from_bytes(key, "little"),) + ((stream,) if stream else ())
+    seq = np.random.SeedSequence(entropy, spawn_key=spawn_key)
+    return np.random.default_rng(seq)
+
+
+def _init_worker(sampler, settings):
+    global _worker_sampler, _worker_settings
+    _worker_sampler = sampler
+    _worker_settings = settings
+
+
+def _sample_chunk(chunk, N, entropy):
+    return [
+        (
+            d,
+            _worker_sampler._sample_disease(
+                d, disease, N, disease_rng(entropy, d), _worker_settings
+            ),
+        )
+        for d, disease in chunk
+    ]
+
+
+class SampleSettings(NamedTuple):
+    """Settings of one call to PatientSampler.sample, see its arguments."""
+
+    dx_criteria_frequency: str
+    default_frequency: List
+    poisson_lambda: float
+    noise_ratio: float
+    omit_frequency: bool
+    noise_weights: np.ndarray = None
+
+
+class ImprecisionTable:
+    """
+    Term reported instead of each term when going s steps up the ontology.
+
+    Column s of a term's row holds the candidate at position s - 1 (or the last
+    one) among its ancestors within s steps, sorted by id, without the
+    uninformative roots. Column 0 is the term itself, as is every column if it
+    has no candidate. Values are indices into terms. Rows stop changing after a
+    few steps, so s is clipped to the table width.
+    """
+
+    uninformative = ("HP:0000118", "HP:0000001")
+
+    def __init__(self, hpo, terms: List[str] = ()):
+        self.hpo = hpo
+        self.terms = []
+        self.rows = {}
+        self._vocab = {}
+        self.table = np.zeros((0, 1), dtype=np.int32)
+        self.extend(terms)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The lookup dictionaries are cheap to rebuild, the table is not.
+        state["rows"] = list(self.rows)
+        del state["_vocab"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.rows = {hp: i for i, hp in enumerate(self.rows)}
+        self._vocab = {hp: i for i, hp in enumerate(self.terms)}
+
+    def _chain(self, hp: str) -> List[str]:
+        """Imprecise term for s = 0, 1, ... until it stops changing."""
+        by_step = {}
+        for ancestor, step in self.hpo.ancestor_distances(hp).items():
+            if ancestor not in self.uninformative:
+                by_step.setdefault(step, []).append(ancestor)
+        if not by_step:
+            return [hp]
+        n_candidates = sum(len(v) for v in by_step.values())
+        chain = [hp]
+        candidates = []
+        for s in range(1, max(max(by_step), n_candidates) + 1):
+            for ancestor in by_step.get(s, []):
+                bisect.insort(candidates, ancestor)
+            chain.append(candidates[min(s - 1, len(candidates) - 1)] if candidates else hp)
+        return chain
+
+    def extend(self, terms: List[str]) -> None:
+        """Add the rows of terms not in the table yet."""
+        chains = []
+        for hp in terms:
+            if hp not in self.rows:
+                self.rows[hp] = len(self.rows)
+                chains.append(self._chain(hp))
+        if not chains:
+            return
+        width = max(self.table.shape[1], max(len(chain) for chain in chains))
+        table = np.empty((len(self.rows), width), dtype=np.int32)
+        old = len(self.table)
+        table[:old, : self.table.shape[1]] = self.table
+        table[:old, self.table.shape[1] :] = self.table[:, -1:]
+        for r, chain in enumerate(chains, old):
+            for hp in chain:
+                if hp not in self._vocab:
+                    self._vocab[hp] = len(self.terms)
+                    self.terms.append(hp)
+            table[r, : len(chain)] = [self._vocab[hp] for hp in chain]
+            table[r, len(chain) :] = table[r, len(chain) - 1]
+        self.table = table
+
+    def sample(self, hpos: List[str], lam: float, rng) -> List[str]:
+        """Replace every term by its imprecise term, with s ~ Poisson(lam)."""
+        self.extend(hpos)
+        rows = np.fromiter((self.rows[hp] for hp in hpos), dtype=np.int64, count=len(hpos))
+        s = np.minimum(rng.poisson(lam, len(hpos)), self.table.shape[1] - 1)
+        return [self.terms[i] for i in self.table[rows, s].tolist()]
+
+
 class PatientSampler:
-    def __init__(self):
+    def __init__(self, diseases=None, hpo=None):
         """
         Class to sample rare disease patients.
+        :param diseases: Disease annotations to sample from. Defaults to the shared DiseaseAnnotations.
+        :param hpo: HPO ontology. Defaults to the shared Hpo instance.
         """
-        self.__poisson_lambda = 1
-        self.__noise_ratio = 0.25
         self.__random_generator = np.random.default_rng()
-        self.__dx_criteria_frequency = "Very frequent"
-        self.__default_frequency = ["HP:0040282", "HP:0040283"]
 
         self.__frequency_by_id = {
             "HP:0040280": {"name": "obligate", "interval": [1.00, 1.00]},
@@ -73,53 +243,85 @@ class PatientSampler:
                 "omit_frequency": False,
             },
         }
-        self.diseases = DiseaseAnnotations()
-        self.hpo = Hpo()
+        self.diseases = diseases or registry.shared_disease_annotations()
+        self.hpo = hpo or registry.shared_hpo()
         self.__eligibles = build_eligibles(self.diseases.data, self.hpo)
+        self.__imprecision_table = None
+        self.__eligible_index = {hp: i for i, hp in enumerate(self.__eligibles)}
+        # Used by samplePatientPhenotype(s) outside of sample.
+        self.__default_settings = self.settings("noise")
 
     def convert_simulations_to_phenopackets(
-        self, simulations: Dict, num_patients: int = 20
+        self, simulations: Dict, num_patients: int = 20, seed: int = None
     ) -> List[Dict]:
-        phenopacket_id_set = set()
-        patient_id_set = set()
-        patient_uuid_map = {}
-        for i in range(num_patients):
-            unique_id = uuid.uuid4().hex
-            while unique_id in patient_id_set:
-                unique_id = uuid.uuid4().hex
-            patient_id_set.add(unique_id)
-            patient_uuid_map[i] = unique_id
-        phenopackets = []
-        for d, data in simulations.items():
+        return list(self.iter_phenopackets(simulations, num_patients, seed))
+
+    def iter_phenopackets(
+        self, simulations, num_patients: int = 20, seed: int = None
+    ) -> Iterator[Dict]:
+        """
+        Yield the phenopacket of each simulated patient, one at a time.
+
+        :param simulations: Simulations dictionary returned by sample, or (disease ID, simulation) pairs as yielded by iter_sample.
+        :type simulations: dict or iterable
+        :param num_patients: Number of patients simulated per disease. Patients with the same index share their subject ID across diseases.
+        :type num_patients: int
+        :param seed: Seed of the random phenopacket and subject IDs.
+        :type seed: int
+        """
+        for id, subject_id, phenotype in self.__iter_records(
+            simulations, num_patients, seed
+        ):
+            phenopacket = {}
+            phenopacket["id"] = id
+            phenopacket["subject"] = {}
+            phenopacket["subject"]["id"] = subject_id
+            phenopacket["phenotypicFeatures"] = []
+            if phenotype:
+                for feature in phenotype:
+                    phenopacket["phenotypicFeatures"].append({"type": {"id": feature}})
+            phenopacket["metaData"] = copy.deepcopy(PHENOPACKET_METADATA)
+            yield phenopacket
+
+    def iter_phenopacket_messages(
+        self, simulations, num_patients: int = 20, seed: int = None
+    ) -> Iterator["Phenopacket"]:
+        """
+        Yield the phenopacket of each simulated patient as a Phenopacket message.
+
+        Messages are filled in directly, without going through JSON, and the
+        metadata is copied from a template built once. Arguments are those of
+        iter_phenopackets, which gives the same phenopackets for the same seed.
+        """
+        from rarecrowds.phenopackets_pb2 import Phenopacket
+
+        metadata = _metadata_template()
+        for id, subject_id, phenotype in self.__iter_records(
+            simulations, num_patients, seed
+        ):
+            phenopacket = Phenopacket(id=id)
+            phenopacket.subject.id = subject_id
+            if phenotype:
+                for feature in phenotype:
+                    phenopacket.phenotypic_features.add().type.id = feature
+            phenopacket.meta_data.CopyFrom(metadata)
+            yield phenopacket
+
+    def __iter_records(self, simulations, num_patients, seed):
+        """Yield (phenopacket ID, subject ID, phenotype) of every simulated patient."""
+        if isinstance(simulations, dict):
+            simulations = simulations.items()
+        # 128 random bits per ID, collisions are not a practical concern.
+        # Phenopacket IDs come from the disease's own stream, so that IDs of
+        # diseases simulated in separate calls with the same seed differ.
+        entropy = np.random.SeedSequence(seed).entropy
+        subject_ids = random_ids(np.random.default_rng(entropy), num_patients)
+        for d, data in simulations:
+            if not data:
+                continue
+            ids = random_ids(disease_rng(entropy, d, stream=1), num_patients)
             for i in range(num_patients):
-                unique_id = uuid.uuid4().hex
-                while unique_id in phenopacket_id_set:
-                    unique_id = uuid.uuid4().hex
-                phenopacket = {}
-                phenopacket["id"] = unique_id
-                phenopacket["subject"] = {}
-                phenopacket["subject"]["id"] = patient_uuid_map[i]
-                phenopacket["phenotypicFeatures"] = []
-                if data["cohort"][i]["phenotype"]:
-                    for feature in data["cohort"][i]["phenotype"]:
-                        phenopacket["phenotypicFeatures"].append(
-                            {"type": {"id": feature}}
-                        )
-                phenopacket["metaData"] = {}
-                phenopacket["metaData"]["submittedBy"] = "patient sampler"
-                phenopacket["metaData"]["resources"] = []
-                phenopacket["metaData"]["resources"].append(
-                    {
-                        "id": "hp",
-                        "name": "human phenotype ontology",
-                        "url": "http://purl.obolibrary.org/obo/hp.owl",
-                        "version": "",
-                        "namespacePrefix": "HP",
-                        "iriPrefix": "http://purl.obolibrary.org/obo/HP_",
-                    }
-                )
-                phenopackets.append(phenopacket)
-        return phenopackets
+                yield ids[i], subject_ids[i], data["cohort"][i]["phenotype"]
 
     def sample(
         self,
@@ -128,6 +330,9 @@ class PatientSampler:
         N: int = 20,
         dx_criteria_frequency: str = "Very frequent",
         default_frequency: List = ["HP:0040282", "HP:0040283"],
+        seed: int = None,
+        workers: int = 1,
+        noise_weights=None,
     ) -> Dict:
         """
         Generate N patients for each of the selected diseases.
@@ -148,185 +353,352 @@ class PatientSampler:
         :type imprecision: int
         :param noise: Ratio of noisy terms compared to patient number of phenotype terms.
         :type noise: float
+        :param seed: Seed of the simulation. Each disease gets its own generator derived from the seed and the disease ID, so results do not depend on the number of workers.
+        :type seed: int
+        :param workers: Number of processes to split the diseases across.
+        :type workers: int
+        :param noise_weights: How noisy terms are weighted. If None, they are drawn uniformly from the eligible terms. If 'frequency', by the number of diseases annotated with them. A dictionary gives the weight of each term, missing terms are never drawn.
+        :type noise_weights: str or dict
         """
 
-        if dx_criteria_frequency.lower() not in set(["obligate", "very frequent"]):
-            raise ValueError(
-                "dx_criteria_frequency is not 'obligate' or 'very frequent'"
+        return dict(
+            self.iter_sample(
+                diseases,
+                patient_params,
+                N,
+                dx_criteria_frequency,
+                default_frequency,
+                seed,
+                workers,
+                noise_weights,
             )
-        self.__dx_criteria_frequency = self.__frequency_by_name[
-            dx_criteria_frequency.lower()
-        ]["id"]
+        )
 
-        self.__default_frequency = default_frequency
+    def iter_sample(
+        self,
+        diseases=None,
+        patient_params: str = "impre",
+        N: int = 20,
+        dx_criteria_frequency: str = "Very frequent",
+        default_frequency: List = ["HP:0040282", "HP:0040283"],
+        seed: int = None,
+        workers: int = 1,
+        noise_weights=None,
+    ) -> Iterator[Tuple[str, Dict]]:
+        """
+        Generate N patients for each of the selected diseases, yielding (disease ID, simulation) pairs one disease at a time.
 
-        self.__poisson_lambda = self.cases[patient_params]["imprecision"]
-        self.__noise_ratio = self.cases[patient_params]["noise"]
-        self.__omit_frequency = self.cases[patient_params]["omit_frequency"]
+        Only the cohorts being simulated are kept in memory, so the memory used does not grow with the number of diseases. Arguments are those of sample, which gives the same simulations for the same seed.
+        """
+        settings = self.settings(
+            patient_params, dx_criteria_frequency, default_frequency, noise_weights
+        )
+        if settings.poisson_lambda and self.__imprecision_table is None:
+            # Built before any process pool is started, so workers inherit it.
+            self.__imprecision_table = ImprecisionTable(self.hpo, self.__eligibles)
 
-        simulations = {}
         if not diseases:
             diseases = self.diseases.data
         elif type(diseases) == str:
             diseases = [diseases]
-        
+
         if type(diseases) == list:
             diseases = {d: self.diseases.data.get(d, {}) for d in diseases}
 
-        for d,disease in diseases.items():
-            try:
-                if not disease:
-                    simulations[d] = {}
-                    continue
-                simulations[d] = {
-                    "id": d,
-                    "name": disease.get("name"),
-                    "phenotype": disease.get("phenotype", {}),
-                    "cohort": [],
-                }
-                for _ in range(N):
-                    simulations[d]["cohort"].append(
-                        {
-                            "ageOnset": self.samplePatientAge(disease.get("ageOnset")),
-                            "phenotype": self.samplePatientPhenotype(
-                                disease.get("phenotype")
-                            ),
-                        }
-                    )
-            except Exception as ex:
-                print(d, "====================", sep="\n")
-                print(disease, "====================", sep="\n")
-                print(simulations[d], "====================", sep="\n")
-                raise ex
-        return simulations
-
-    def samplePatientPhenotype(self, phenotype: Dict) -> List[str]:
+        entropy = np.random.SeedSequence(seed).entropy
+        items = list(diseases.items())
+        if workers > 1 and len(items) > 1:
+            return self.__iter_pool(items, N, entropy, workers, settings)
+        return (
+            (d, self._sample_disease(d, disease, N, disease_rng(entropy, d), settings))
+            for d, disease in items
+        )
+
+    def iter_patients(self, *args, **kwargs) -> Iterator[Tuple[str, int, Dict]]:
         """
-        Create new patient with configured imprecision and noise levels.
+        Yield (disease ID, patient index, patient) triples one patient at a time. Arguments are those of iter_sample.
         """
-        if phenotype:
-            try:
-                if self.__omit_frequency:
-                    hpo_list = list(phenotype)
-                else:
-                    hpo_list = self.__sample_symptom(phenotype)
-                hpo_list = self.__imprecise_hpos(hpo_list)
-                hpo_list.extend(self.__random_hpos(hpo_list))
-                hpos = {i: {} for i in hpo_list}
-                return hpos
-            except Exception as ex:
-                raise ex
-        else:
+        for d, simulation in self.iter_sample(*args, **kwargs):
+            for i, patient in enumerate(simulation.get("cohort", [])):
+                yield d, i, patient
+
+    def __iter_pool(self, items, N, entropy, workers, settings, chunk_size=64):
+        """Sample diseases in a process pool, keeping a bounded number of chunks in flight."""
+        chunk_size = max(1, min(chunk_size, len(items) // (4 * workers)))
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(self, settings)
+        ) as executor:
+            pending = deque()
+            for i in range(0, len(items), chunk_size):
+                chunk = items[i : i + chunk_size]
+                pending.append(executor.submit(_sample_chunk, chunk, N, entropy))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def settings(
+        self,
+        patient_params: str = "impre",
+        dx_criteria_frequency: str = "Very frequent",
+        default_frequency: List = ["HP:0040282", "HP:0040283"],
+        noise_weights=None,
+    ) -> SampleSettings:
+        """
+        Resolve the simulation arguments of sample, which are then fixed for the
+        whole call, even if the sampler is used with other arguments meanwhile.
+        """
+        if dx_criteria_frequency.lower() not in set(["obligate", "very frequent"]):
+            raise ValueError(
+                "dx_criteria_frequency is not 'obligate' or 'very frequent'"
+            )
+        if patient_params not in self.cases:
+            raise ValueError(
+                f"Unknown patient_params '{patient_params}', "
+                f"expected one of {list(self.cases)}"
+            )
+        case = self.cases[patient_params]
+        return SampleSettings(
+            dx_criteria_frequency=self.__frequency_by_name[
+                dx_criteria_frequency.lower()
+            ]["id"],
+            default_frequency=default_frequency,
+            poisson_lambda=case["imprecision"],
+            noise_ratio=case["noise"],
+            omit_frequency=case["omit_frequency"],
+            noise_weights=self.__noise_weights(noise_weights),
+        )
+
+    def __noise_weights(self, noise_weights):
+        if noise_weights is None:
             return None
+        if noise_weights == "frequency":
+            weights = annotation_frequency(self.diseases.data, self.__eligibles)
+        elif isinstance(noise_weights, dict):
+            weights = [noise_weights.get(hp, 0) for hp in self.__eligibles]
+        else:
+            raise ValueError("noise_weights must be None, 'frequency' or a dictionary")
+        return as_weights(weights)
+
+    def _sample_disease(self, d, disease, N, rng, settings) -> Dict:
+        """Simulate the cohort of N patients of a single disease."""
+        if not disease:
+            return {}
+        simulation = {
+            "id": d,
+            "name": disease.get("name"),
+            "phenotype": copy.deepcopy(disease.get("phenotype", {})),
+            "cohort": [],
+        }
+        try:
+            phenotypes = self.samplePatientPhenotypes(
+                disease.get("phenotype"), N, rng, settings
+            )
+            ages = self.samplePatientAges(disease.get("ageOnset"), N, rng)
+            for age, phenotype in zip(ages, phenotypes):
+                simulation["cohort"].append({"ageOnset": age, "phenotype": phenotype})
+        except Exception as ex:
+            print(d, "====================", sep="\n")
+            print(disease, "====================", sep="\n")
+            print(simulation, "====================", sep="\n")
+            raise ex
+        return simulation
 
-    def __random_hpos(self, hpos):
+    def samplePatientPhenotype(
+        self, phenotype: Dict, rng=None, settings: SampleSettings = None
+    ) -> List[str]:
         """
-        Sample valid HPO terms.
-        The max number of terms is controlled at the class instantiation.
-        A Poisson distribution is used to sample how many terms to add.
+        Create new patient with the imprecision and noise levels of settings,
+        those of the noise simulation mode by default.
+        """
+        return self.samplePatientPhenotypes(phenotype, 1, rng, settings)[0]
+
+    def samplePatientPhenotypes(
+        self, phenotype: Dict, N: int, rng=None, settings: SampleSettings = None
+    ) -> List[Dict]:
         """
-        hpos = set(hpos)
-        max_count = int(len(hpos) * self.__noise_ratio + 0.5)
-        count = self.__random_generator.integers(
-            0, max_count + 1
-        )  ## upper limit is excluded
-        if count > 0:
-            res = list()
-            while len(res) == 0 or any(x in hpos for x in res):
-                res = list(self.__random_generator.choice(self.__eligibles, count))
-            return res
+        Create N new patients with the imprecision and noise levels of settings,
+        see samplePatientPhenotype. Symptom presence is sampled for the whole
+        cohort at once.
+        """
+        if rng is None:
+            rng = self.__random_generator
+        if settings is None:
+            settings = self.__default_settings
+        if not phenotype:
+            return [None] * N
+        if settings.omit_frequency:
+            hpo_lists = [list(phenotype) for _ in range(N)]
         else:
-            return []
+            hpo_lists = self.__sample_symptoms(phenotype, N, rng, settings)
+        hpo_lists = self.__imprecise_hpos(hpo_lists, rng, settings)
+        noise = self.__random_hpos(hpo_lists, rng, settings)
+        patients = []
+        for hpo_list, extra in zip(hpo_lists, noise):
+            hpo_list.extend(extra)
+            patients.append({i: {} for i in hpo_list})
+        return patients
+
+    def __random_hpos(self, hpo_lists, rng, settings):
+        """
+        Sample valid HPO terms for every patient.
+        The max number of terms is controlled at the class instantiation.
+        A uniform distribution is used to sample how many terms to add.
+        Terms are drawn without replacement among the eligible terms that the
+        patient does not have, uniformly or following the noise weights.
+        """
+        if not settings.noise_ratio:
+            return [[] for _ in hpo_lists]
+        hpo_sets = [set(hpos) for hpos in hpo_lists]
+        max_counts = [int(len(hpos) * settings.noise_ratio + 0.5) for hpos in hpo_sets]
+        counts = rng.integers(0, np.array(max_counts) + 1)  ## upper limit is excluded
+        excluded = [
+            [self.__eligible_index[hp] for hp in hpos if hp in self.__eligible_index]
+            for hpos in hpo_sets
+        ]
+        drawn = sample_complement(
+            rng, len(self.__eligibles), excluded, counts, settings.noise_weights
+        )
+        return [[self.__eligibles[i] for i in res.tolist()] for res in drawn]
 
-    def __imprecise_hpos(self, hps):
+    def __imprecise_hpos(self, hpo_lists, rng, settings):
         """
-        Get a random ancestor following a Poisson distribution with lambda parameter
-        especified in the constructor. The function may return the same input hp
-        depending on the random number.
+        Replace the terms of every patient by a random ancestor, going s steps up
+        the ontology with s following a Poisson distribution with lambda parameter
+        especified in the constructor. A term may be kept depending on the random
+        number. All terms of the batch are looked up at once in the imprecision table.
         """
         # s is the index of the ancestor to take. If s=0, the nominal is returned.
         # If s=2, the 2nd ancestor is taken.
-        if self.__poisson_lambda == 0 or not hps:
-            return hps
-        if type(hps) == str:
-            s = self.__random_generator.poisson(self.__poisson_lambda)
-            if s == 0:
-                return hps
-            ancestors = list(self.hpo.predecessors(hps, depth=s))
-            # Remove those that would be way too uninformative.
-            to_remove = ["HP:0000118", "HP:0000001"]
-            candidates = [i for i in ancestors if i not in to_remove]
-            if not candidates:
-                return hps
-            return candidates[min(s - 1, len(candidates) - 1)]
-        else:  ## Assuming it is a list, a set, a tuple, etc
-            return [self.__imprecise_hpos(i) for i in hps]
-
-    def __sample_symptom(self, phenotype):
-        """First sample the probability from the interval, then sample the symptom using that probability."""
-        l = set()
-        while not l:
-            for hp, data in phenotype.items():
-                f = data.get("frequency")
-                if not f and data.get("modifier", {}).get("diagnosticCriteria"):
-                    f = self.__dx_criteria_frequency
-                elif not f:
-                    if type(self.__default_frequency) == str:
-                        f = self.__default_frequency
-                    else:
-                        f = self.__random_generator.choice(self.__default_frequency)
-                minf, maxf = self.__frequency_by_id[f]["interval"]
-                if (
-                    self.__random_generator.random()
-                    < (maxf - minf) * self.__random_generator.random() + minf
-                ):
-                    l.add(hp)
-        return list(l)
-
-    def samplePatientAge(self, age):
+        if settings.poisson_lambda == 0:
+            return hpo_lists
+        if self.__imprecision_table is None:
+            self.__imprecision_table = ImprecisionTable(self.hpo, self.__eligibles)
+        flat = [hp for hpo_list in hpo_lists for hp in hpo_list]
+        flat = self.__imprecision_table.sample(flat, settings.poisson_lambda, rng)
+        res = []
+        start = 0
+        for hpo_list in hpo_lists:
+            res.append(flat[start : start + len(hpo_list)])
+            start += len(hpo_list)
+        return res
+
+    def __compile_phenotype(self, phenotype, settings):
+        """
+        Resolve the frequency interval of every symptom into arrays.
+        Symptoms whose frequency is sampled from the default frequency list
+        are flagged and get their interval at sampling time.
+        """
+        terms = list(phenotype)
+        low = np.zeros(len(terms))
+        high = np.zeros(len(terms))
+        sampled = np.zeros(len(terms), dtype=bool)
+        for j, data in enumerate(phenotype.values()):
+            f = data.get("frequency")
+            if not f and data.get("modifier", {}).get("diagnosticCriteria"):
+                f = settings.dx_criteria_frequency
+            elif not f:
+                if type(settings.default_frequency) == str:
+                    f = settings.default_frequency
+                else:
+                    sampled[j] = True
+                    continue
+            low[j], high[j] = self.__frequency_by_id[f]["interval"]
+        return terms, low, high, sampled
+
+    def __sample_symptoms(self, phenotype, N, rng, settings):
+        """
+        First sample the probability from the interval, then sample the symptom using that probability.
+        Patients without any symptom are sampled again.
+        """
+        terms, low, high, sampled = self.__compile_phenotype(phenotype, settings)
+        if type(settings.default_frequency) != str:
+            defaults = np.array(
+                [
+                    self.__frequency_by_id[f]["interval"]
+                    for f in settings.default_frequency
+                ]
+            )
+        if not sampled.any() and not high.any():
+            # Every symptom is excluded, resampling would never end.
+            return [[] for _ in range(N)]
+        present = np.zeros((N, len(terms)), dtype=bool)
+        pending = np.arange(N)
+        while len(pending):
+            lows = np.broadcast_to(low, (len(pending), len(terms))).copy()
+            highs = np.broadcast_to(high, (len(pending), len(terms))).copy()
+            if sampled.any():
+                choice = rng.integers(len(defaults), size=(len(pending), sampled.sum()))
+                lows[:, sampled] = defaults[choice, 0]
+                highs[:, sampled] = defaults[choice, 1]
+            shape = (len(pending), len(terms))
+            p = (highs - lows) * rng.random(shape) + lows
+            present[pending] = rng.random(shape) < p
+            pending = pending[~present[pending].any(axis=1)]
+        return [[terms[j] for j in np.flatnonzero(row)] for row in present]
+
+    def samplePatientAge(self, age, rng=None):
         """Sample the age of a patient.
         First the onset is sampled taking only the central part of a normal distribution. If a max age is not provided, a sigma of 5 years is assumed and no hard-cap is imposed on the + side of the mode.
         Then the time of visit is sampled from a Gumbel function with a mode of 2 weeks.
         Ages from http://www.orphadata.org/cgi-bin/img/PDF/OrphadataFreeAccessProductsDescription.pdf"""
+        return self.samplePatientAges(age, 1, rng)[0]
 
-        def sampleOnset(rng, a, b=None):
-            """Sample from normal distribution and keep +-sigma within interval. 10% noise is added to each side."""
-            if a is None and b is None:
-                return None
-            onset = -10000
-            noise = 0.1
-            if b:
-                sigma = (b - a) / 2
-                mu = a + sigma
-                while onset < (1 - noise) * a or onset > (1 + noise) * b:
-                    onset = rng.normal(mu, sigma)
-            else:
-                sigma = 5  # years
-                mu = a + sigma
-                while onset < (1 - noise) * a:
-                    onset = rng.normal(mu, sigma)
-            return onset
-
-        def sampleVisit(rng):
-            """It assumes a mode of the time to visit distribution (represented by a Gumbel dist) of 2 weeks.
-            Returns a time from symptom discovery to visit in years."""
-            visit = -10000
-            beta = 1
-            mu = 2  # two weeks
-            while mu + visit < 0:
-                visit = rng.gumbel(mu, beta)
-            return visit / (365 / 7)  # to years
-
-        if age:
-            o = Onset(age)
-            # print('Final interval', age, o.min, o.max)
-            onset = sampleOnset(self.__random_generator, o.min, o.max)
-            if onset is None:
-                return None
-            visit = sampleVisit(self.__random_generator)
-            return onset + visit
-        else:
-            return None
+    def samplePatientAges(self, age, N: int, rng=None) -> List[float]:
+        """Sample the ages of N patients with the same onset, see samplePatientAge."""
+        if rng is None:
+            rng = self.__random_generator
+        if not age:
+            return [None] * N
+        a, b = onset_interval(age if type(age) == str else tuple(age))
+        # print('Final interval', age, a, b)
+        onsets = sample_onsets(rng, a, b, N)
+        if onsets is None:
+            return [None] * N
+        return (onsets + sample_visits(rng, N)).tolist()
+
+
+@lru_cache(maxsize=None)
+def onset_interval(age) -> Tuple[float, float]:
+    """Onset interval in years of an age string or tuple of age strings, parsed once."""
+    o = Onset(age)
+    return o.min, o.max
+
+
+def sample_onsets(rng, a, b, size, noise=0.1):
+    """
+    Sample onsets from a normal distribution, keeping +-sigma within the interval
+    widened by 10% noise on each side. If there is no max age, sigma is 5 years and
+    only the lower side is truncated. The truncated normal is sampled by inverse CDF.
+    An interval of a single age gives that age.
+    """
+    from scipy.special import ndtr, ndtri
+
+    if a is None:
+        return None
+    if b and b == a:
+        return np.full(size, float(a))
+    if b:
+        sigma = (b - a) / 2
+        upper = (1 + noise) * b
+    else:
+        sigma = 5  # years
+        upper = np.inf
+    mu = a + sigma
+    low, high = ndtr(((1 - noise) * a - mu) / sigma), ndtr((upper - mu) / sigma)
+    return mu + sigma * ndtri(low + (high - low) * rng.random(size))
+
+
+def sample_visits(rng, size, mu=2, beta=1):
+    """
+    Sample times from symptom discovery to visit in years. They follow a Gumbel
+    distribution with a mode of 2 weeks, truncated to non-negative times, which is
+    sampled by inverse CDF.
+    """
+    low = np.exp(-np.exp(2 * mu / beta))  # CDF at visit = -mu
+    u = low + (1 - low) * rng.random(size)
+    visit = mu - beta * np.log(-np.log(u))
+    return visit / (365 / 7)  # to years
 
 
 class Onset:
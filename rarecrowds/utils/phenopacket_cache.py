@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator
+
+VERSION = 1
+
+
+def cache_paths(dataset: str, data_path: str):
+    """Paths of the cached phenopackets and manifest of a dataset."""
+    base = os.path.join(data_path, dataset)
+    return f"{base}.phenopackets", f"{base}.manifest.json"
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if not n:
+            out.append(byte)
+            return bytes(out)
+        out.append(byte | 0x80)
+
+
+def source_checksums(folder: str, previous: Dict = None) -> Dict[str, Dict]:
+    """Size, modification time and SHA-1 of every file in folder.
+
+    Files whose size and modification time match the previous checksums are
+    not read again.
+    """
+    previous = previous or {}
+    res = {}
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not os.path.isfile(path):
+            continue
+        st = os.stat(path)
+        old = previous.get(name)
+        if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime_ns:
+            res[name] = old
+            continue
+        with open(path, "rb") as fp:
+            digest = hashlib.sha1(fp.read()).hexdigest()
+        res[name] = {"size": st.st_size, "mtime": st.st_mtime_ns, "sha1": digest}
+    return res
+
+
+def write_cache(
+    dataset: str,
+    data_path: str,
+    phenopackets: Iterable,
+    sources: Dict,
+    errors: Iterable = (),
+) -> Dict:
+    """Store phenopackets as length-delimited binary messages plus a manifest.
+
+    Both files are written to temporary names and renamed into place, the
+    manifest last, so a cache with a manifest is always complete. The
+    (path, error) pairs of the source files that could not be loaded are
+    kept in the manifest.
+    """
+    cache_path, manifest_path = cache_paths(dataset, data_path)
+    count = 0
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fp:
+        for phenopacket in phenopackets:
+            data = phenopacket.SerializeToString()
+            fp.write(_varint(len(data)))
+            fp.write(data)
+            count += 1
+    os.replace(tmp_path, cache_path)
+    manifest = {
+        "version": VERSION,
+        "dataset": dataset,
+        "count": count,
+        "sources": sources,
+        "errors": [list(error) for error in errors],
+        "built": datetime.now(timezone.utc).isoformat(),
+    }
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(manifest, fp, indent=1)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def read_manifest(dataset: str, data_path: str) -> Dict:
+    """Manifest of the cached dataset, None if there is no usable cache."""
+    cache_path, manifest_path = cache_paths(dataset, data_path)
+    try:
+        with open(manifest_path) as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != VERSION or not os.path.exists(cache_path):
+        return None
+    return manifest
+
+
+def is_fresh(manifest: Dict, folder: str) -> bool:
+    """Whether the source files in folder are those the cache was built from."""
+    if not manifest or not os.path.isdir(folder):
+        return False
+    sources = manifest["sources"]
+    current = source_checksums(folder, sources)
+    return {k: v["sha1"] for k, v in current.items()} == {
+        k: v["sha1"] for k, v in sources.items()
+    }
+
+
+def read_cache(dataset: str, data_path: str) -> Iterator:
+    """Yield the cached Phenopacket messages of a dataset."""
+    from rarecrowds.phenopackets_pb2 import Phenopacket
+
+    cache_path, _ = cache_paths(dataset, data_path)
+    with open(cache_path, "rb") as fp:
+        data = fp.read()
+    pos = 0
+    while pos < len(data):
+        size = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            size |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        phenopacket = Phenopacket()
+        phenopacket.ParseFromString(data[pos : pos + size])
+        pos += size
+        yield phenopacket
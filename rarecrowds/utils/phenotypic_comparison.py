@@ -2,14 +2,14 @@ import networkx as nx
 import plotly.graph_objects as go
 from typing import List, Dict
 
-from rarecrowds.utils.hpo import Hpo
+from rarecrowds.utils import registry
 
 
 class PhenotypicComparison():
     """Class to visually compare two phenotype profiles."""
 
     def __init__(self, patient=None, disease=None):
-        self.hpo = Hpo()
+        self.hpo = registry.shared_hpo()
 
         assert ((patient is not None) or (disease is not None))
 
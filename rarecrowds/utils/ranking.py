@@ -0,0 +1,390 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+from typing import Hashable, Iterator, List, Tuple
+
+import numpy as np
+
+from rarecrowds.utils.closure import gather_rows
+from rarecrowds.utils.information_content import annotation_arrays, compute_ic
+from rarecrowds.utils.snapshot import read_snapshot, write_snapshot
+
+METHODS = ("resnik", "lin")
+_worker_ranker = None
+
+
+def _init_worker(path, hpo):
+    global _worker_ranker
+    _worker_ranker = DiseaseRanker.load(path, hpo)
+
+
+def _rank_block(queries, k):
+    return _worker_ranker._rank_block(queries, k)
+
+
+class DiseaseRanker:
+    """Rank diseases by the similarity of their phenotype to a patient's.
+
+    The similarity of two terms is the IC of their most informative common
+    ancestor (Resnik), or that IC over the mean IC of both terms (Lin). A
+    query is scored against every disease as the best match average: the
+    mean over the query terms of their best match among the disease terms,
+    and, if symmetric, averaged with the same mean the other way around.
+
+    Annotations are compiled once into arrays: the distinct annotated terms
+    with their ancestors, and the (disease, term) annotations sorted by
+    disease. Scoring a query is a few gathers and reductions over them.
+    Only diseases with annotated terms in the ontology are ranked.
+    """
+
+    _ARRAYS = (
+        "ic",
+        "terms",
+        "_pair_term",
+        "_starts",
+        "_sizes",
+        "_term_ic",
+        "_columns",
+        "_anc_col",
+        "_anc_ptr",
+        "_column_of",
+        "_column_ic",
+        "_desc_ptr",
+        "_desc_idx",
+        "_post_ptr",
+        "_post_idx",
+    )
+
+    def __init__(
+        self,
+        annotations=None,
+        hpo=None,
+        method: str = "resnik",
+        symmetric: bool = True,
+        ic: np.ndarray = None,
+    ):
+        """
+        :param annotations: DiseaseAnnotations, or a dict of diseases as in its
+            data attribute. Defaults to the shared Orphanet annotations.
+        :param hpo: HPO ontology. Defaults to the shared Hpo instance.
+        :param method: Term similarity, "resnik" or "lin".
+        :param symmetric: Whether to average both directions of the best match average.
+        :param ic: IC of every ontology term. Defaults to the IC of the annotations.
+        """
+        from rarecrowds.utils import registry
+
+        if method not in METHODS:
+            raise ValueError(f"Unknown method '{method}', expected one of {METHODS}")
+        self.hpo = hpo or registry.shared_hpo()
+        if annotations is None:
+            annotations = registry.shared_disease_annotations()
+        data = getattr(annotations, "data", annotations)
+        arrays = annotation_arrays(self.hpo, data)
+        if ic is None:
+            if hasattr(annotations, "information_content"):
+                ic = annotations.information_content(self.hpo)
+            else:
+                ic = compute_ic(self.hpo, arrays)
+        self.method = method
+        self.symmetric = symmetric
+        self.ic = np.asarray(ic, dtype=np.float64)
+        self._compile(arrays)
+
+    def _compile(self, arrays):
+        ranked = np.unique(arrays.disease)
+        self.diseases = [arrays.diseases[d] for d in ranked.tolist()]
+        # Annotations sorted by disease, then by term.
+        pair_disease = np.searchsorted(ranked, arrays.disease)
+        self._starts = np.flatnonzero(
+            np.concatenate(([True], pair_disease[1:] != pair_disease[:-1]))
+        )
+        self._sizes = np.diff(np.append(self._starts, len(pair_disease)))
+        # Distinct annotated terms, and each annotation as a position among them.
+        self.terms, self._pair_term = np.unique(arrays.term, return_inverse=True)
+        self._term_ic = self.ic[self.terms]
+        # Terms that can be a common ancestor get compact columns. Ancestors
+        # of term u (itself included) are _anc_col[_anc_ptr[u]:_anc_ptr[u + 1]].
+        closure = self.hpo.closure_csr(ancestors=True)
+        owners, ancestors, counts = gather_rows(*closure, self.terms)
+        owners = np.concatenate((np.arange(len(self.terms)), owners))
+        ancestors = np.concatenate((self.terms, ancestors))
+        order = np.argsort(owners, kind="stable")
+        owners, ancestors = owners[order], ancestors[order]
+        self._columns, self._anc_col = np.unique(ancestors, return_inverse=True)
+        self._anc_ptr = np.concatenate(([0], np.cumsum(counts + 1)))
+        self._column_of = np.full(len(self.hpo.items), -1, dtype=np.int64)
+        self._column_of[self._columns] = np.arange(len(self._columns))
+        self._column_ic = self.ic[self._columns]
+        # Annotated terms below each column, and diseases with a term below it.
+        self._desc_ptr, self._desc_idx = _transpose(
+            owners, self._anc_col, len(self._columns)
+        )
+        pair, cols, _ = gather_rows(self._anc_ptr, self._anc_col, self._pair_term)
+        keys = np.unique(cols * len(self.diseases) + pair_disease[pair])
+        self._post_ptr, self._post_idx = _transpose(
+            keys % len(self.diseases), keys // len(self.diseases), len(self._columns)
+        )
+
+    def save(self, path: str) -> None:
+        """Write the compiled arrays to a snapshot, see load."""
+        meta = {
+            "diseases": self.diseases,
+            "method": self.method,
+            "symmetric": self.symmetric,
+            "hpo": self.hpo.digest,
+        }
+        write_snapshot(path, {name: getattr(self, name) for name in self._ARRAYS}, meta)
+
+    @classmethod
+    def load(cls, path: str, hpo=None) -> "DiseaseRanker":
+        """Open a ranker written by save. Its arrays are memory-mapped, so
+        every process loading the same file shares them."""
+        from rarecrowds.utils import registry
+
+        arrays, meta, _ = read_snapshot(path)
+        ranker = cls.__new__(cls)
+        ranker.hpo = hpo or registry.shared_hpo()
+        if meta["hpo"] != ranker.hpo.digest:
+            raise ValueError(f"'{path}' was compiled with another version of the HPO")
+        ranker.diseases = meta["diseases"]
+        ranker.method = meta["method"]
+        ranker.symmetric = meta["symmetric"]
+        for name in cls._ARRAYS:
+            setattr(ranker, name, arrays[name])
+        return ranker
+
+    def __len__(self):
+        return len(self.diseases)
+
+    def query_terms(self, phenotype: List[str]) -> np.ndarray:
+        """Ontology indices of the distinct known terms of a phenotype."""
+        cols = self.hpo.indices(list(dict.fromkeys(phenotype)))
+        return cols[cols >= 0]
+
+    def _ancestor_columns(self, query: np.ndarray):
+        """(position in query, column) of the ancestors of every query term,
+        itself included, that can be a common ancestor."""
+        owners, ancestors, _ = gather_rows(*self.hpo.closure_csr(True), query)
+        rows = np.concatenate((np.arange(len(query)), owners))
+        cols = self._column_of[np.concatenate((query, ancestors))]
+        return rows[cols >= 0], cols[cols >= 0]
+
+    def _fill(self, ptr, idx, rows, cols, shape) -> np.ndarray:
+        """res[r, t] is the largest IC of the columns c of row r with t in
+        idx[ptr[c]:ptr[c + 1]].
+
+        Columns are written in order of increasing IC, one assignment per
+        column, so the last write to each target is the largest.
+        """
+        res = np.zeros(shape)
+        keep = self._column_ic[cols] > 0
+        keys = np.unique(cols[keep] * shape[0] + rows[keep])
+        rows, cols = keys % shape[0], keys // shape[0]
+        order = np.argsort(self._column_ic[cols], kind="stable")
+        rows, cols = rows[order], cols[order]
+        bounds = np.flatnonzero(np.concatenate(([True], cols[1:] != cols[:-1], [True])))
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            c = cols[start]
+            targets = idx[ptr[c] : ptr[c + 1]]
+            if end - start == 1:
+                res[rows[start], targets] = self._column_ic[c]
+            else:
+                res[rows[start:end, None], targets] = self._column_ic[c]
+        return res
+
+    def term_similarity(self, query: np.ndarray) -> np.ndarray:
+        """Similarity of every query term (ontology indices) to every annotated term."""
+        rows, cols = self._ancestor_columns(query)
+        return self._similarity(query, rows, cols)
+
+    def _similarity(self, query, rows, cols):
+        shape = (len(query), len(self.terms))
+        mica = self._fill(self._desc_ptr, self._desc_idx, rows, cols, shape)
+        if self.method == "resnik":
+            return mica
+        denominator = self.ic[query][:, None] + self._term_ic[None, :]
+        return np.divide(
+            2 * mica, denominator, out=np.zeros_like(mica), where=denominator > 0
+        )
+
+    def scores(self, phenotype: List[str]) -> np.ndarray:
+        """Score of every disease, in the order of the diseases attribute."""
+        return self.block_scores([self.query_terms(phenotype)])[0]
+
+    def block_scores(self, queries: List[np.ndarray]) -> np.ndarray:
+        """Scores of every query (ontology indices, see query_terms) against
+        every disease, one row per query."""
+        res = np.zeros((len(queries), len(self.diseases)))
+        scored = [i for i, query in enumerate(queries) if len(query)]
+        if scored:
+            res[scored] = self._block_scores([queries[i] for i in scored])
+        return res
+
+    def _block_scores(self, queries):
+        sizes = np.array([len(query) for query in queries])
+        query = np.concatenate(queries)
+        owner = np.repeat(np.arange(len(queries)), sizes)
+        term_starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        rows, cols = self._ancestor_columns(query)
+        if self.method == "resnik":
+            # The best match of a term in a disease is its most informative
+            # ancestor below which the disease has a term, and the other way
+            # around for the best match of a disease term in a query.
+            shape = (len(query), len(self.diseases))
+            best = self._fill(self._post_ptr, self._post_idx, rows, cols, shape)
+            if self.symmetric:
+                shape = (len(queries), len(self.terms))
+                reverse = self._fill(
+                    self._desc_ptr, self._desc_idx, owner[rows], cols, shape
+                )
+        else:
+            similarity = self._similarity(query, rows, cols)
+            pairs = similarity[:, self._pair_term]
+            best = np.maximum.reduceat(pairs, self._starts, axis=1)
+            if self.symmetric:
+                reverse = np.maximum.reduceat(similarity, term_starts, axis=0)
+        res = np.add.reduceat(best, term_starts, axis=0) / sizes[:, None]
+        if self.symmetric:
+            reverse = np.add.reduceat(reverse[:, self._pair_term], self._starts, axis=1)
+            res = (res + reverse / self._sizes) / 2
+        return res
+
+    def rank(self, phenotype: List[str], k: int = 10) -> List[Tuple[str, float]]:
+        """The k best scoring diseases with their scores, best first."""
+        return top_k(self.scores(phenotype), k, self.diseases)
+
+    def term_diseases(self, hp: str) -> List[str]:
+        """Diseases annotated with the term or any of its descendants."""
+        i = self.hpo.indices([hp])[0]
+        col = self._column_of[i] if i >= 0 else -1
+        if col < 0:
+            return []
+        postings = self._post_idx[self._post_ptr[col] : self._post_ptr[col + 1]]
+        return [self.diseases[d] for d in postings.tolist()]
+
+    def query_bytes(self, size: int) -> int:
+        """Approximate memory used to score a query of size terms in a block."""
+        diseases, terms, pairs = (
+            len(self.diseases),
+            len(self.terms),
+            len(self._pair_term),
+        )
+        if self.method == "resnik":
+            per_term = diseases
+        else:
+            per_term = terms + pairs + diseases
+        per_query = diseases + (terms + pairs if self.symmetric else 0)
+        return 8 * (size * per_term + per_query)
+
+    def _rank_block(self, queries, k):
+        """Indices and scores of the k best diseases of every query."""
+        scores = self.block_scores(queries)
+        best = np.array([_top_indices(row, k) for row in scores], dtype=np.int64)
+        best = best.reshape(len(queries), -1)
+        return best, np.take_along_axis(scores, best, axis=1)
+
+    def _blocks(self, patients, memory):
+        keys = []
+        queries = []
+        used = 0
+        for key, phenotype in patients:
+            query = self.query_terms(phenotype)
+            size = self.query_bytes(len(query))
+            if queries and used + size > memory:
+                yield keys, queries
+                keys, queries, used = [], [], 0
+            keys.append(key)
+            queries.append(query)
+            used += size
+        if queries:
+            yield keys, queries
+
+    def rank_cohort(
+        self,
+        patients,
+        k: int = 10,
+        workers: int = 1,
+        memory: int = 1 << 28,
+    ) -> Iterator[Tuple[Hashable, List[Tuple[str, float]]]]:
+        """
+        Rank the diseases for every patient of a cohort, yielding the patient
+        and its k best diseases with their scores, as rank does.
+        Patients are scored in blocks that take about memory bytes, in a pool
+        of worker processes if workers > 1. Workers memory-map the compiled
+        arrays from a temporary snapshot, so they share them. Results are
+        yielded in the order of the patients as their blocks finish.
+        :param patients: PhenotypicDatabase, whose patients are the phenopacket
+            ids, or simulations as returned by PatientSampler.sample (or the
+            pairs yielded by iter_sample), whose patients are (disease id,
+            position in the cohort) pairs.
+        :param k: Number of diseases returned for each patient.
+        :param workers: Number of processes to score blocks in.
+        :param memory: Approximate memory, in bytes, used to score each block.
+        """
+        blocks = self._blocks(cohort_phenotypes(patients), memory)
+        if workers <= 1:
+            for keys, queries in blocks:
+                yield from self._block_results(keys, *self._rank_block(queries, k))
+            return
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ranker.snap")
+            self.save(path)
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(path, self.hpo)
+            ) as executor:
+                in_flight = deque()
+                for keys, queries in blocks:
+                    in_flight.append((keys, executor.submit(_rank_block, queries, k)))
+                    if len(in_flight) >= 2 * workers:
+                        keys, future = in_flight.popleft()
+                        yield from self._block_results(keys, *future.result())
+                while in_flight:
+                    keys, future = in_flight.popleft()
+                    yield from self._block_results(keys, *future.result())
+
+    def _block_results(self, keys, best, scores):
+        for key, row, row_scores in zip(keys, best.tolist(), scores.tolist()):
+            yield key, [(self.diseases[i], s) for i, s in zip(row, row_scores)]
+
+
+def cohort_phenotypes(patients) -> Iterator[Tuple[Hashable, List[str]]]:
+    """(patient, HPO terms) of every patient of a PhenotypicDatabase or of
+    simulations, see DiseaseRanker.rank_cohort. Negated features are left out."""
+    if hasattr(patients, "db"):
+        for id, phenopacket in patients.db.items():
+            yield id, [
+                feature.type.id
+                for feature in phenopacket.phenotypic_features
+                if not feature.negated
+            ]
+        return
+    if isinstance(patients, dict):
+        patients = patients.items()
+    for d, simulation in patients:
+        for i, patient in enumerate((simulation or {}).get("cohort", [])):
+            yield (d, i), patient["phenotype"] or []
+
+
+def _top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first, ties by position."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    threshold = -np.partition(-scores, k - 1)[k - 1]
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[: k - len(above)]
+    best = np.concatenate((above, ties))
+    return best[np.lexsort((best, -scores[best]))]
+
+
+def top_k(scores: np.ndarray, k: int, labels: List[str]) -> List[Tuple[str, float]]:
+    """The k highest scores with their labels, best first, ties by position."""
+    return [(labels[i], float(scores[i])) for i in _top_indices(scores, k).tolist()]
+
+
+def _transpose(rows: np.ndarray, cols: np.ndarray, size: int):
+    """CSR arrays (ptr, idx) listing the rows of every column."""
+    order = np.argsort(cols, kind="stable")
+    ptr = np.concatenate(([0], np.cumsum(np.bincount(cols, minlength=size))))
+    return ptr, rows[order]
@@ -0,0 +1,108 @@
+import os
+import threading
+from typing import Callable, List
+
+RESOURCES_PATH = os.path.join(os.path.dirname(__file__), "resources")
+
+_lock = threading.RLock()
+_instances = {}
+
+
+def resource_path(name: str) -> str:
+    """Path of a file in the packaged resources directory."""
+    return os.path.join(RESOURCES_PATH, name)
+
+
+def cache_dir() -> str:
+    """Directory of the files built from the packaged resources, like ontology
+    snapshots: $XDG_CACHE_HOME/rarecrowds, by default ~/.cache/rarecrowds."""
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(root, "rarecrowds")
+
+
+def cache_path(name: str) -> str:
+    """Path of a file in the user cache directory."""
+    return os.path.join(cache_dir(), name)
+
+
+def _version(paths: List[str]) -> tuple:
+    """Modification time and size of every resource file, None if missing."""
+    version = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            version.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+def get_shared(factory: Callable, paths: List[str], *args, **kwargs):
+    """Return the process-wide instance built by factory(*args, **kwargs).
+
+    Instances are keyed by factory, arguments and the resource files they are
+    loaded from. If any of those files changed on disk since the instance was
+    built, it is rebuilt. Shared instances must be treated as read-only.
+    """
+    paths = tuple(os.path.abspath(path) for path in paths)
+    key = (factory, paths, args, tuple(sorted(kwargs.items())))
+    with _lock:
+        entry = _instances.get(key)
+        if entry is not None and entry[0] == _version(paths):
+            return entry[1]
+        instance = factory(*args, **kwargs)
+        # Loading may write a faster cache (e.g. an ontology snapshot), so the
+        # version is taken afterwards.
+        _instances[key] = (_version(paths), instance)
+        return instance
+
+
+def invalidate(path: str = None) -> None:
+    """Drop shared instances loaded from path, or all of them if not given."""
+    with _lock:
+        if path is None:
+            _instances.clear()
+            return
+        path = os.path.abspath(path)
+        for key in [key for key in _instances if path in key[1]]:
+            del _instances[key]
+
+
+def shared_hpo():
+    from rarecrowds.utils.hpo import Hpo
+
+    return get_shared(Hpo, [cache_path("hp.snap"), resource_path("hp.pkl")])
+
+
+def shared_mondo():
+    from rarecrowds.utils.mondo import Mondo
+
+    return get_shared(
+        Mondo, [cache_path("mondo.snap"), resource_path("mondo.obo.pkl")]
+    )
+
+
+def shared_orpha():
+    from rarecrowds.utils.orpha import Orpha
+
+    return get_shared(Orpha, [resource_path("orphadata_all_prods.pkl")])
+
+
+def shared_hpoa():
+    from rarecrowds.utils.hpoa import Hpoa
+
+    return get_shared(Hpoa, [resource_path("phenotype.hpoa.pkl")])
+
+
+def shared_disease_annotations(mode: str = "orpha"):
+    from rarecrowds.utils.disease_annotations import DiseaseAnnotations
+
+    paths = [
+        resource_path("orphadata_all_prods.pkl"),
+        resource_path("phenotype.hpoa.pkl"),
+        cache_path("mondo.snap"),
+        resource_path("mondo.obo.pkl"),
+    ]
+    return get_shared(DiseaseAnnotations, paths, mode=mode)
@@ -0,0 +1,129 @@
+import numpy as np
+
+
+def as_weights(weights) -> np.ndarray:
+    """Weights of a discrete distribution as a float array, checked to be
+    non-negative with a positive sum."""
+    p = np.asarray(weights, dtype=float)
+    if p.ndim != 1 or not len(p) or (p < 0).any() or p.sum() <= 0:
+        raise ValueError("Weights must be non-negative with a positive sum.")
+    return p
+
+
+def _flatten(excluded):
+    owners = np.repeat(np.arange(len(excluded)), [len(e) for e in excluded])
+    if len(owners):
+        values = np.concatenate([np.asarray(e, dtype=np.int64) for e in excluded])
+    else:
+        values = np.zeros(0, dtype=np.int64)
+    return owners, values
+
+
+def _group(owners, values, size):
+    order = np.argsort(owners, kind="stable")
+    bounds = np.cumsum(np.bincount(owners, minlength=size))[:-1]
+    return np.split(values[order], bounds)
+
+
+def sample_complement(rng, n, excluded, counts, weights=None):
+    """Draw distinct values of range(n) not in excluded[p], counts[p] of them for each p.
+
+    excluded is a list of arrays of distinct values, one per row p. Counts are
+    clipped to the number of values available. Without weights values are
+    uniform, otherwise they follow the weights, see as_weights. Either way
+    values are drawn rejection-free, one per row at a time: the r-th free
+    value, or the value at mass u of the free weight, is found by a binary
+    search over the excluded and already drawn values, whose weights are
+    left out. Returns one array per row.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    size = len(counts)
+    ex_owners, ex_values = _flatten(excluded)
+    if weights is None:
+        free = n - np.bincount(ex_owners, minlength=size)
+        counts = np.minimum(counts, free)
+        return _uniform_complement(rng, n, ex_owners, ex_values, counts)
+    weights = as_weights(weights)
+    positive = weights > 0
+    free = positive.sum() - np.bincount(
+        ex_owners, weights=positive[ex_values], minlength=size
+    ).astype(np.int64)
+    counts = np.minimum(counts, free)
+    return _weighted_complement(rng, n, ex_owners, ex_values, counts, weights)
+
+
+def _uniform_complement(rng, n, owners, values, counts):
+    size = len(counts)
+    drawn_owners = []
+    drawn_values = []
+    taken = np.bincount(owners, minlength=size)
+    for j in range(counts.max(initial=0)):
+        active = np.flatnonzero(counts > j)
+        r = rng.integers(0, n - taken[active])
+        # Taken values of each row, sorted: the r-th free value is r plus the
+        # number of taken values v whose rank i among them has v - i <= r.
+        order = np.lexsort((values, owners))
+        owners = owners[order]
+        values = values[order]
+        starts = np.searchsorted(owners, np.arange(size))
+        keys = owners * (n + 1) + values - (np.arange(len(values)) - starts[owners])
+        v = r + np.searchsorted(keys, active * (n + 1) + r, side="right") - starts[active]
+        owners = np.concatenate([owners, active])
+        values = np.concatenate([values, v])
+        taken[active] += 1
+        drawn_owners.append(active)
+        drawn_values.append(v)
+    if not drawn_owners:
+        return [np.zeros(0, dtype=np.int64) for _ in range(size)]
+    return _group(np.concatenate(drawn_owners), np.concatenate(drawn_values), size)
+
+
+def _weighted_complement(rng, n, owners, values, counts, weights):
+    size = len(counts)
+    cum = np.cumsum(weights)
+    drawn_owners = []
+    drawn_values = []
+    taken_mass = np.bincount(owners, weights=weights[values], minlength=size)
+    for j in range(counts.max(initial=0)):
+        active = np.flatnonzero(counts > j)
+        # Taken values of each row, sorted, with the running sum of their
+        # weights: the free mass up to v is cum[v] minus the taken mass up to v.
+        order = np.lexsort((values, owners))
+        owners = owners[order]
+        values = values[order]
+        keys = owners * n + values
+        prefix = np.concatenate(([0.0], np.cumsum(weights[values])))
+        row_start = prefix[np.searchsorted(owners, active)]
+        u = rng.random(len(active)) * (cum[-1] - taken_mass[active])
+        # The drawn value is the first one whose free mass up to it exceeds u.
+        lo = np.zeros(len(active), dtype=np.int64)
+        hi = np.full(len(active), n - 1)
+        while (lo < hi).any():
+            mid = (lo + hi) // 2
+            taken = prefix[np.searchsorted(keys, active * n + mid, side="right")]
+            right = cum[mid] - (taken - row_start) <= u
+            lo = np.where(right, mid + 1, lo)
+            hi = np.where(right, hi, mid)
+        v = _round_off(lo, active, keys, n, weights)
+        owners = np.concatenate([owners, active])
+        values = np.concatenate([values, v])
+        taken_mass[active] += weights[v]
+        drawn_owners.append(active)
+        drawn_values.append(v)
+    if not drawn_owners:
+        return [np.zeros(0, dtype=np.int64) for _ in range(size)]
+    return _group(np.concatenate(drawn_owners), np.concatenate(drawn_values), size)
+
+
+def _round_off(v, active, keys, n, weights):
+    """Move values that rounding of the cumulative sums left on a taken or
+    zero weight value to the closest free one, below if there is one."""
+    bad = np.flatnonzero(np.isin(active * n + v, keys) | (weights[v] <= 0))
+    for i in bad.tolist():
+        row = keys[(keys >= active[i] * n) & (keys < (active[i] + 1) * n)] % n
+        free = np.ones(n, dtype=bool)
+        free[row] = False
+        free &= weights > 0
+        below = np.flatnonzero(free[: v[i]])
+        v[i] = below[-1] if len(below) else np.flatnonzero(free)[0]
+    return v
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"RCSNAP\x00\x00"
+VERSION = 1
+_ALIGN = 64
+_PREFIX = struct.Struct("<8sII")
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _raw(arr):
+    return memoryview(arr.reshape(-1).view(np.uint8))
+
+
+def is_snapshot(path: str) -> bool:
+    """Whether path is a file written by write_snapshot."""
+    try:
+        with open(path, "rb") as fp:
+            return fp.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_snapshot(path: str, arrays: dict, meta: dict = None) -> str:
+    """Write named arrays to a binary snapshot that can be memory-mapped.
+
+    The file holds a fixed prefix (magic, format version, header length), a
+    JSON header describing every section and the 64-byte aligned raw array
+    data. The file is written to a temporary name and renamed into place, so
+    readers never see a partial snapshot. Returns the content digest.
+    """
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    digest = hashlib.sha1()
+    sections = {}
+    offset = 0
+    for name, arr in arrays.items():
+        sections[name] = {
+            "dtype": arr.dtype.str,
+            "shape": list(arr.shape),
+            "offset": offset,
+            "nbytes": arr.nbytes,
+        }
+        digest.update(name.encode())
+        digest.update(arr.dtype.str.encode())
+        digest.update(_raw(arr))
+        offset = _aligned(offset + arr.nbytes)
+    header = json.dumps(
+        {"sections": sections, "meta": meta or {}, "digest": digest.hexdigest()}
+    ).encode()
+    data_start = _aligned(_PREFIX.size + len(header))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as fp:
+            fp.write(_PREFIX.pack(MAGIC, VERSION, len(header)))
+            fp.write(header)
+            for name, arr in arrays.items():
+                fp.seek(data_start + sections[name]["offset"])
+                fp.write(_raw(arr))
+            fp.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return digest.hexdigest()
+
+
+def read_snapshot(path: str):
+    """Memory-map a snapshot and return (arrays, meta, digest).
+
+    Arrays are read-only views into the shared mapping, so opening is cheap
+    and the pages are shared between every process reading the same file.
+    """
+    with open(path, "rb") as fp:
+        magic, version, header_len = _PREFIX.unpack(fp.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"'{path}' is not a rarecrowds snapshot")
+        if version != VERSION:
+            raise ValueError(
+                f"Unsupported snapshot version {version} in '{path}' (expected {VERSION})"
+            )
+        header = json.loads(fp.read(header_len))
+        buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    data_start = _aligned(_PREFIX.size + header_len)
+    arrays = {}
+    for name, section in header["sections"].items():
+        dtype = np.dtype(section["dtype"])
+        if not section["nbytes"]:
+            arrays[name] = np.empty(section["shape"], dtype=dtype)
+            continue
+        count = section["nbytes"] // dtype.itemsize
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + section["offset"]
+        ).reshape(section["shape"])
+    return arrays, header["meta"], header["digest"]
@@ -0,0 +1,202 @@
+import sqlite3
+from collections.abc import ItemsView, MutableMapping, ValuesView
+from typing import Iterator, List
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS phenopackets (
+    id TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subjects (id TEXT NOT NULL, subject TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS terms (
+    id TEXT NOT NULL,
+    hpo TEXT NOT NULL,
+    negated INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS diseases (id TEXT NOT NULL, disease TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS genes (id TEXT NOT NULL, symbol TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS subjects_subject ON subjects (subject);
+CREATE INDEX IF NOT EXISTS subjects_id ON subjects (id);
+CREATE INDEX IF NOT EXISTS terms_hpo ON terms (hpo, negated);
+CREATE INDEX IF NOT EXISTS terms_id ON terms (id);
+CREATE INDEX IF NOT EXISTS diseases_disease ON diseases (disease);
+CREATE INDEX IF NOT EXISTS diseases_id ON diseases (id);
+CREATE INDEX IF NOT EXISTS genes_symbol ON genes (symbol);
+CREATE INDEX IF NOT EXISTS genes_id ON genes (id);
+"""
+_SIDE_TABLES = ("subjects", "terms", "diseases", "genes")
+
+
+class _Values(ValuesView):
+    def __iter__(self):
+        return self._mapping._iter_rows(values=True)
+
+
+class _Items(ItemsView):
+    def __iter__(self):
+        return self._mapping._iter_rows(values=False)
+
+
+class SqliteStore(MutableMapping):
+    """Phenopackets stored as serialized protobuf blobs in a SQLite file.
+
+    Behaves as the dict of phenopackets by id of PhenotypicDatabase. Messages
+    are only deserialized when accessed. Writes are buffered and inserted in
+    one transaction every batch_size phenopackets, and before any read. The
+    side tables subjects, terms, diseases and genes are indexed for lookups.
+    The file is opened in WAL mode, so several processes can read it while
+    one writes.
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = {}
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        self.flush()
+        return {"path": self.path, "batch_size": self.batch_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["batch_size"])
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+    def flush(self) -> None:
+        """Insert the buffered phenopackets in a single transaction."""
+        if not self._pending:
+            return
+        pending = list(self._pending.values())
+        self._pending = {}
+        ids = [(p.id,) for p in pending]
+        rows = {name: [] for name in _SIDE_TABLES}
+        for p in pending:
+            if p.subject.id:
+                rows["subjects"].append((p.id, p.subject.id))
+            for feature in p.phenotypic_features:
+                rows["terms"].append((p.id, feature.type.id, int(feature.negated)))
+            for disease in p.diseases:
+                if disease.term.id:
+                    rows["diseases"].append((p.id, disease.term.id))
+            for gene in p.genes:
+                if gene.symbol:
+                    rows["genes"].append((p.id, gene.symbol))
+        with self._conn:
+            for name in _SIDE_TABLES:
+                self._conn.executemany(f"DELETE FROM {name} WHERE id = ?", ids)
+            self._conn.executemany(
+                "INSERT INTO phenopackets (id, data) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET data = excluded.data",
+                [(p.id, p.SerializeToString()) for p in pending],
+            )
+            self._conn.executemany(
+                "INSERT INTO subjects VALUES (?, ?)", rows["subjects"]
+            )
+            self._conn.executemany("INSERT INTO terms VALUES (?, ?, ?)", rows["terms"])
+            self._conn.executemany(
+                "INSERT INTO diseases VALUES (?, ?)", rows["diseases"]
+            )
+            self._conn.executemany("INSERT INTO genes VALUES (?, ?)", rows["genes"])
+
+    @staticmethod
+    def _parse(data):
+        from rarecrowds.phenopackets_pb2 import Phenopacket
+
+        phenopacket = Phenopacket()
+        phenopacket.ParseFromString(data)
+        return phenopacket
+
+    def __setitem__(self, id, phenopacket):
+        if id != phenopacket.id:
+            raise KeyError(f"Phenopacket '{phenopacket.id}' stored as '{id}'")
+        self._pending[id] = phenopacket
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def __getitem__(self, id):
+        if id in self._pending:
+            return self._pending[id]
+        row = self._conn.execute(
+            "SELECT data FROM phenopackets WHERE id = ?", (id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(id)
+        return self._parse(row[0])
+
+    def __delitem__(self, id):
+        self.flush()
+        with self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM phenopackets WHERE id = ?", (id,)
+            ).rowcount
+            for name in _SIDE_TABLES:
+                self._conn.execute(f"DELETE FROM {name} WHERE id = ?", (id,))
+        if not deleted:
+            raise KeyError(id)
+
+    def __contains__(self, id):
+        if id in self._pending:
+            return True
+        return (
+            self._conn.execute(
+                "SELECT 1 FROM phenopackets WHERE id = ?", (id,)
+            ).fetchone()
+            is not None
+        )
+
+    def __iter__(self) -> Iterator[str]:
+        self.flush()
+        for (id,) in self._conn.execute("SELECT id FROM phenopackets ORDER BY rowid"):
+            yield id
+
+    def __len__(self):
+        self.flush()
+        return self._conn.execute("SELECT COUNT(*) FROM phenopackets").fetchone()[0]
+
+    def values(self):
+        return _Values(self)
+
+    def items(self):
+        return _Items(self)
+
+    def _iter_rows(self, values):
+        self.flush()
+        cursor = self._conn.execute("SELECT id, data FROM phenopackets ORDER BY rowid")
+        for id, data in cursor:
+            yield self._parse(data) if values else (id, self._parse(data))
+
+    def _ids(self, table, condition, args) -> List[str]:
+        """Ids with a matching side table row, in the order they were added."""
+        self.flush()
+        query = (
+            f"SELECT id FROM phenopackets WHERE id IN "
+            f"(SELECT id FROM {table} WHERE {condition}) ORDER BY rowid"
+        )
+        return [id for (id,) in self._conn.execute(query, args)]
+
+    def ids_by_subject(self, subject: str) -> List[str]:
+        """Ids of the phenopackets of a subject."""
+        return self._ids("subjects", "subject = ?", (subject,))
+
+    def ids_by_term(self, hpo: str, negated: bool = False) -> List[str]:
+        """Ids of the phenopackets with the HPO term as a phenotypic feature."""
+        return self._ids("terms", "hpo = ? AND negated = ?", (hpo, int(negated)))
+
+    def ids_by_disease(self, disease: str) -> List[str]:
+        """Ids of the phenopackets with the disease."""
+        return self._ids("diseases", "disease = ?", (disease,))
+
+    def ids_by_gene(self, symbol: str) -> List[str]:
+        """Ids of the phenopackets with the gene symbol."""
+        return self._ids("genes", "symbol = ?", (symbol,))
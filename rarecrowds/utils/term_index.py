@@ -0,0 +1,167 @@
+from typing import Iterable, List
+
+import numpy as np
+
+from rarecrowds.utils.closure import gather_rows
+
+
+class TermIndex:
+    """Inverted index from HPO terms to the phenopackets that have them.
+
+    A phenopacket has a term when one of its (non negated) phenotypic features
+    is the term or one of its descendants. Phenopackets are numbered in the
+    order they are added and postings are kept as sorted arrays of those
+    numbers: a CSR table over the ontology terms, plus the pairs added since
+    it was last rebuilt. Pending pairs are merged into the table once there
+    are compact_every of them, or an eighth of the table if more, so the
+    merges cost time linear in the number of pairs overall. Terms not in the
+    ontology are only indexed directly. Adding a phenopacket with an id
+    already indexed replaces it.
+    """
+
+    def __init__(self, hpo=None, compact_every: int = 1 << 16):
+        if hpo is None:
+            from rarecrowds.utils import registry
+
+            hpo = registry.shared_hpo()
+        self.hpo = hpo
+        self.compact_every = compact_every
+        self._columns = {hp: i for i, hp in enumerate(hpo.items)}
+        self._ancestors = hpo.closure_csr(ancestors=True)
+        self.ids = []
+        self._doc = {}
+        self._alive = bytearray()
+        self._ptr = np.zeros(len(self._columns) + 1, dtype=np.int64)
+        self._idx = np.zeros(0, dtype=np.int64)
+        self._pending_docs = []
+        self._pending_cols = []
+        self._pending_size = 0
+        self._extra = {}
+
+    def __len__(self):
+        return len(self._doc)
+
+    def _new_doc(self, id: str) -> int:
+        old = self._doc.get(id)
+        if old is not None:
+            self._alive[old] = 0
+        doc = self._doc[id] = len(self.ids)
+        self.ids.append(id)
+        self._alive.append(1)
+        return doc
+
+    def _expand(self, docs, cols):
+        """(doc, term) pairs of the features, their ancestors included, without repeats."""
+        docs = np.asarray(docs, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        owners, ancestors, _ = gather_rows(*self._ancestors, cols)
+        docs = np.concatenate((docs, docs[owners]))
+        cols = np.concatenate((cols, ancestors))
+        pairs = np.sort(docs * len(self._columns) + cols)
+        if len(pairs):
+            pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+        return pairs // len(self._columns), pairs % len(self._columns)
+
+    def add(self, phenopacket) -> None:
+        """Index one phenopacket."""
+        self.extend([phenopacket], compact=False)
+
+    def extend(self, phenopackets: Iterable, compact: bool = True) -> None:
+        """Index many phenopackets at once."""
+        docs = []
+        cols = []
+        for phenopacket in phenopackets:
+            doc = self._new_doc(phenopacket.id)
+            for feature in phenopacket.phenotypic_features:
+                if feature.negated:
+                    continue
+                col = self._columns.get(feature.type.id)
+                if col is None:
+                    postings = self._extra.setdefault(feature.type.id, [])
+                    if not postings or postings[-1] != doc:
+                        postings.append(doc)
+                else:
+                    docs.append(doc)
+                    cols.append(col)
+        docs, cols = self._expand(docs, cols)
+        self._pending_docs.append(docs)
+        self._pending_cols.append(cols)
+        self._pending_size += len(docs)
+        limit = max(self.compact_every, len(self._idx) >> 3)
+        if compact or self._pending_size >= limit:
+            self._compact()
+
+    def _pending(self):
+        """Pending pairs as two arrays."""
+        if len(self._pending_docs) > 1:
+            self._pending_docs = [np.concatenate(self._pending_docs)]
+            self._pending_cols = [np.concatenate(self._pending_cols)]
+        return self._pending_docs[0], self._pending_cols[0]
+
+    def _compact(self):
+        """Merge the pending pairs into the CSR table."""
+        if not self._pending_size:
+            return
+        docs, cols = self._pending()
+        self._pending_docs = []
+        self._pending_cols = []
+        self._pending_size = 0
+        # Pending documents are newer than the indexed ones, so inserting them
+        # at the end of their rows, sorted by term and then by document (a
+        # stable sort of pairs sorted by document), keeps the rows sorted.
+        order = np.argsort(cols, kind="stable")
+        docs, cols = docs[order], cols[order]
+        self._idx = np.insert(self._idx, self._ptr[cols + 1], docs)
+        self._ptr[1:] += np.cumsum(np.bincount(cols, minlength=len(self._ptr) - 1))
+
+    def _live(self, docs):
+        alive = np.frombuffer(self._alive, dtype=np.uint8)
+        return docs[alive[docs].astype(bool)] if len(docs) else docs
+
+    def postings(self, hp: str) -> np.ndarray:
+        """Sorted numbers of the phenopackets having the term."""
+        col = self._columns.get(hp)
+        if col is None:
+            return self._live(np.array(self._extra.get(hp, []), dtype=np.int64))
+        res = self._idx[self._ptr[col] : self._ptr[col + 1]]
+        if self._pending_size:
+            # Pending documents are newer than the indexed ones.
+            docs, cols = self._pending()
+            res = np.concatenate((res, docs[cols == col]))
+        return self._live(res)
+
+    def _all(self):
+        return np.flatnonzero(np.frombuffer(self._alive, dtype=np.uint8))
+
+    def docs(self, all_of=(), any_of=(), none_of=()) -> np.ndarray:
+        """Sorted numbers of the phenopackets matching the query, see query."""
+        if all_of:
+            res = self.postings(all_of[0])
+            for hp in all_of[1:]:
+                res = np.intersect1d(res, self.postings(hp), assume_unique=True)
+        else:
+            res = self._all()
+        if any_of:
+            matches = np.unique(np.concatenate([self.postings(hp) for hp in any_of]))
+            res = np.intersect1d(res, matches, assume_unique=True)
+        if none_of:
+            excluded = np.concatenate([self.postings(hp) for hp in none_of])
+            res = res[~np.isin(res, excluded)]
+        return res
+
+    def query(self, all_of=(), any_of=(), none_of=()) -> List[str]:
+        """Ids of the phenopackets with all the terms of all_of, at least one of
+        any_of and none of none_of, in the order they were added."""
+        return [self.ids[doc] for doc in self.docs(all_of, any_of, none_of).tolist()]
+
+    def at_least(self, terms: List[str], k: int) -> List[str]:
+        """Ids of the phenopackets with at least k of the terms."""
+        if k <= 0:
+            return self.query()
+        if not terms:
+            return []
+        counts = np.bincount(
+            np.concatenate([self.postings(hp) for hp in set(terms)]),
+            minlength=len(self.ids),
+        )
+        return [self.ids[doc] for doc in np.flatnonzero(counts >= k).tolist()]
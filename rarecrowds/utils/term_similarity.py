@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List
+
+import numpy as np
+
+from rarecrowds.utils.ranking import DiseaseRanker, top_k
+
+if TYPE_CHECKING:
+    import scipy.sparse
+
+
+class TermSimilarity:
+    """Similarity between every pair of annotated HPO terms.
+
+    The matrix over the ~16k terms annotated to some disease takes gigabytes
+    when dense, so it is computed in blocks of rows on demand, from the
+    closure arrays of a DiseaseRanker (see its term_similarity), and only
+    the most recently used blocks are kept, up to a memory budget. Rows and
+    columns follow the terms attribute. The similarity is Resnik or Lin, as
+    the ranker's method.
+    """
+
+    def __init__(self, ranker=None, block_size: int = 256, memory: int = 1 << 28):
+        """
+        :param ranker: DiseaseRanker whose annotated terms are compared.
+            Defaults to a Resnik ranker of the shared Orphanet annotations.
+        :param block_size: Number of rows computed at once.
+        :param memory: Approximate bytes of cached blocks.
+        """
+        if ranker is None:
+            ranker = DiseaseRanker()
+        self.ranker = ranker
+        ids = list(ranker.hpo.items)
+        self.terms = [ids[i] for i in ranker.terms.tolist()]
+        self._position = {hp: i for i, hp in enumerate(self.terms)}
+        self.block_size = max(int(block_size), 1)
+        block_bytes = 8 * self.block_size * max(len(self.terms), 1)
+        self.max_blocks = max(memory // block_bytes, 1)
+        self._blocks = OrderedDict()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def position(self, hp: str) -> int:
+        """Row and column of an annotated term."""
+        try:
+            return self._position[hp]
+        except KeyError:
+            raise KeyError(f"'{hp}' is not annotated to any disease") from None
+
+    def _compute(self, b: int) -> np.ndarray:
+        rows = self.ranker.terms[b * self.block_size : (b + 1) * self.block_size]
+        return self.ranker.term_similarity(rows)
+
+    def block(self, b: int) -> np.ndarray:
+        """Rows b * block_size to (b + 1) * block_size of the matrix.
+
+        Cached blocks are returned as is and must not be modified. Once more
+        than max_blocks are cached, the least recently used one is dropped.
+        """
+        if b in self._blocks:
+            self._blocks.move_to_end(b)
+            return self._blocks[b]
+        res = self._compute(b)
+        res.flags.writeable = False
+        self._blocks[b] = res
+        if len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return res
+
+    def row(self, hp: str) -> np.ndarray:
+        """Similarity of a term to every annotated term."""
+        b, i = divmod(self.position(hp), self.block_size)
+        return self.block(b)[i]
+
+    def similarity(self, a: str, b: str) -> float:
+        """Similarity of two annotated terms."""
+        return float(self.row(a)[self.position(b)])
+
+    def most_similar(self, hp: str, k: int = 10) -> List[tuple]:
+        """The k annotated terms most similar to a term, with their similarity."""
+        return top_k(self.row(hp), k, self.terms)
+
+    def sparse(self, threshold: float) -> "scipy.sparse.csr_matrix":
+        """The matrix without the similarities below threshold.
+
+        Blocks are computed one at a time and not cached, so memory is that
+        of one block plus the entries kept. Resnik similarities of terms
+        whose only common ancestors are frequent, like Phenotypic abnormality,
+        are low, so a threshold of about 1 already drops most pairs.
+        """
+        import scipy.sparse
+
+        rows, cols, data = [], [], []
+        for b in range((len(self.terms) + self.block_size - 1) // self.block_size):
+            block = self._blocks.get(b)
+            if block is None:
+                block = self._compute(b)
+            r, c = np.nonzero((block >= threshold) & (block > 0))
+            rows.append(r + b * self.block_size)
+            cols.append(c)
+            data.append(block[r, c])
+        shape = (len(self.terms), len(self.terms))
+        if not data:
+            return scipy.sparse.csr_matrix(shape)
+        return scipy.sparse.csr_matrix(
+            (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=shape,
+        )
@@ -17,6 +17,7 @@ setup(
     long_description_content_type='text/markdown',
     packages=find_packages(exclude=["test"]),
     install_requires=requirements,
+    extras_require={"parquet": ["pyarrow>=1.0"]},
     package_dir={'rarecrowds': 'rarecrowds'},
     package_data={'rarecrowds': ['resources/*', 'utils/resources/*']},
     include_package_data=True,
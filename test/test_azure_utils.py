@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from rarecrowds.utils.azure_utils import download_data
+
+
+class _Downloader:
+    def __init__(self, data):
+        self.data = data
+
+    def readinto(self, stream):
+        stream.write(self.data)
+        return len(self.data)
+
+
+class _Container:
+    """Local stand-in for an azure ContainerClient."""
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.downloads = []
+        self.failures = {}
+
+    def put(self, name, data):
+        version = self.blobs.get(name, (None, 0))[1] + 1
+        self.blobs[name] = (data, version)
+
+    def list_blobs(self):
+        return [
+            {"name": name, "size": len(data), "etag": f'"{name}-{version}"'}
+            for name, (data, version) in self.blobs.items()
+        ]
+
+    def download_blob(self, name):
+        self.downloads.append(name)
+        if self.failures.get(name):
+            self.failures[name] -= 1
+            raise ConnectionError("connection reset")
+        return _Downloader(self.blobs[name][0])
+
+
+def test_download_data_sync(tmp_path):
+    container = _Container({})
+    for i in range(20):
+        container.put(f"{i}.json", b'{"id": "%d"}' % i)
+    data_path = str(tmp_path)
+    folder = tmp_path / "kleyner-2016"
+    stats = download_data("kleyner-2016", data_path, container_client=container)
+    assert stats == {"downloaded": 20, "skipped": 0, "removed": 0}
+    assert sorted(os.listdir(folder)) == sorted(f"{i}.json" for i in range(20))
+    assert (folder / "3.json").read_bytes() == b'{"id": "3"}'
+
+    # Only changed blobs are downloaded again, deleted ones are removed.
+    container.downloads = []
+    container.put("3.json", b'{"id": "three"}')
+    del container.blobs["4.json"]
+    container.failures["3.json"] = 2
+    stats = download_data(
+        "kleyner-2016", data_path, backoff=0, container_client=container
+    )
+    assert stats == {"downloaded": 1, "skipped": 18, "removed": 1}
+    assert container.downloads == ["3.json"] * 3
+    assert (folder / "3.json").read_bytes() == b'{"id": "three"}'
+    assert not (folder / "4.json").exists()
+    assert len(os.listdir(folder)) == 19
+
+    container.put("5.json", b"new")
+    container.failures["5.json"] = 10
+    with pytest.raises(OSError):
+        download_data(
+            "kleyner-2016", data_path, retries=1, backoff=0, container_client=container
+        )
+    # The previous content is kept when a download fails.
+    assert (folder / "5.json").read_bytes() == b'{"id": "5"}'
+    assert len(os.listdir(folder)) == 19
+
+
+def test_download_data_file_mode(tmp_path):
+    container = _Container({"a.json": (b"{}", 1)})
+    umask = os.umask(0o022)
+    try:
+        download_data("kleyner-2016", str(tmp_path), container_client=container)
+    finally:
+        os.umask(umask)
+    assert os.stat(tmp_path / "kleyner-2016" / "a.json").st_mode & 0o777 == 0o644
+    assert os.stat(tmp_path / "kleyner-2016.sync.json").st_mode & 0o777 == 0o644
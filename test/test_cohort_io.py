@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from rarecrowds.utils import registry
+from rarecrowds.utils.cohort_io import CohortWriter, read_cohorts, read_vocabulary
+
+SIMULATIONS = {
+    "ORPHA:1": {
+        "id": "ORPHA:1",
+        "cohort": [
+            {"ageOnset": 3.5, "phenotype": {"HP:0001250": {}, "HP:0001263": {}}},
+            {"ageOnset": None, "phenotype": {"HP:9999999": {}}},
+        ],
+    },
+    "ORPHA:2": {},
+    "ORPHA:3": {"id": "ORPHA:3", "cohort": [{"ageOnset": 40.0, "phenotype": None}]},
+    "ORPHA:4": {"id": "ORPHA:4", "cohort": [{"ageOnset": 1.0, "phenotype": {"HP:0001250": {}}}]},
+}
+
+
+def test_cohort_writer_roundtrip(tmp_path):
+    hpo = registry.shared_hpo()
+    path = str(tmp_path / "cohorts")
+    with CohortWriter(path, hpo, diseases_per_shard=2, row_group_size=2) as writer:
+        writer.write(iter(SIMULATIONS.items()))
+    assert len(writer.files) == 2
+    assert sorted(os.listdir(path)) == [
+        "cohort-00000.parquet",
+        "cohort-00001.parquet",
+        "vocabulary.parquet",
+    ]
+    vocabulary = read_vocabulary(path)
+    assert vocabulary[: len(hpo.items)] == list(hpo.items)
+    assert vocabulary[-1] == "HP:9999999"
+    table = read_cohorts(path)
+    rows = table.to_pylist()
+    assert [(r["disease_id"], r["patient"], r["ageOnset"]) for r in rows] == [
+        ("ORPHA:1", 0, 3.5),
+        ("ORPHA:1", 1, None),
+        ("ORPHA:3", 0, 40.0),
+        ("ORPHA:4", 0, 1.0),
+    ]
+    assert [[vocabulary[i] for i in r["hpo"]] for r in rows] == [
+        ["HP:0001250", "HP:0001263"],
+        ["HP:9999999"],
+        [],
+        ["HP:0001250"],
+    ]
+
+
+def test_missing_pyarrow(tmp_path, monkeypatch):
+    import builtins
+
+    real_import = builtins.__import__
+
+    def no_pyarrow(name, *args, **kwargs):
+        if name.startswith("pyarrow"):
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", no_pyarrow)
+    with pytest.raises(ImportError, match=r"rarecrowds\[parquet\]"):
+        CohortWriter(str(tmp_path))
@@ -0,0 +1,45 @@
+import json
+import subprocess
+import sys
+
+HEAVY_MODULES = [
+    "pandas",
+    "plotly",
+    "azure.storage.blob",
+    "networkx",
+    "pronto",
+    "pydot",
+    "google.protobuf",
+]
+
+# Generous wall-clock budget for `import rarecrowds` in a fresh interpreter.
+IMPORT_BUDGET_SECONDS = 0.5
+
+
+def _run(code):
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    )
+    return json.loads(out.stdout)
+
+
+def test_import_is_lazy():
+    loaded = _run(
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import rarecrowds\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(json.dumps([elapsed, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))"
+    )
+    elapsed, heavy = loaded
+    assert heavy == []
+    assert elapsed < IMPORT_BUDGET_SECONDS
+
+
+def test_ontology_import_is_light():
+    heavy = _run(
+        "import json, sys\n"
+        "from rarecrowds import Hpo, PatientSampler\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    assert heavy == []
@@ -0,0 +1,55 @@
+import numpy as np
+
+from rarecrowds.utils import registry
+from rarecrowds.utils.information_content import (
+    annotation_arrays,
+    compute_ic,
+    ic_path,
+    load_ic,
+)
+
+DISEASES = {
+    "ORPHA:1": {
+        "phenotype": {
+            "HP:0001250": {"frequency": "HP:0040280"},
+            "HP:0001263": {},
+            "HP:0000252": {"frequency": "HP:0040285"},
+        }
+    },
+    "ORPHA:2": {"phenotype": {"HP:0001250": {}, "HP:9999999": {}}},
+    "ORPHA:3": {"phenotype": {"HP:0000365": {}}},
+    "ORPHA:4": {"name": "Disease without phenotype"},
+}
+
+
+def test_information_content(tmp_path):
+    hpo = registry.shared_hpo()
+    annotations = annotation_arrays(hpo, DISEASES)
+    assert annotations.diseases == ["ORPHA:1", "ORPHA:2", "ORPHA:3", "ORPHA:4"]
+    assert annotations.disease.tolist() == [0, 0, 1, 2]
+
+    ic = compute_ic(hpo, annotations)
+    index = hpo._index
+    for hp in ("HP:0001250", "HP:0000001", "HP:0000118", "HP:0000365", "HP:0000252"):
+        annotated = [
+            d
+            for d, disease in DISEASES.items()
+            if any(
+                t == hp or hp in hpo.predecessors(t, 100)
+                for t, s in (disease.get("phenotype") or {}).items()
+                if t in index and s.get("frequency") != "HP:0040285"
+            )
+        ]
+        expected = np.log(3 / len(annotated)) if annotated else np.log(3)
+        assert np.isclose(ic[index[hp]], expected)
+    assert ic[index["HP:0000001"]] == 0
+    assert ic[index["HP:0000252"]] == np.log(3)
+
+    path = str(tmp_path / "hp.ic-test.snap")
+    stored = load_ic(hpo, annotations, path)
+    assert np.array_equal(stored, ic)
+    assert np.array_equal(load_ic(hpo, annotations, path), ic)
+    changed = annotation_arrays(hpo, {**DISEASES, "ORPHA:5": DISEASES["ORPHA:3"]})
+    assert changed.digest != annotations.digest
+    assert not np.array_equal(load_ic(hpo, changed, path), ic)
+    assert ic_path(hpo, "orpha") == registry.cache_path("hp.ic-orpha.snap")
@@ -0,0 +1,150 @@
+import os
+import pickle
+
+import networkx as nx
+
+from rarecrowds.utils.ontograph import OntoGraph
+
+
+def _toy_graph(tmp_path):
+    G = nx.DiGraph()
+    G.add_edges_from(
+        [
+            ("HP:0000001", "HP:0000002"),
+            ("HP:0000001", "HP:0000003"),
+            ("HP:0000002", "HP:0000004"),
+            ("HP:0000003", "HP:0000004"),
+            ("HP:0000004", "HP:0000005"),
+            ("HP:0000002", "HP:0000006"),
+        ]
+    )
+    for node in G.nodes:
+        G.nodes[node]["id"] = node
+        G.nodes[node]["label"] = node.lower()
+    path = tmp_path / "toy.pkl"
+    with open(path, "wb") as fp:
+        pickle.dump(G, fp)
+    return str(path)
+
+
+def test_closure_matches_graph_walk(tmp_path):
+    path = _toy_graph(tmp_path)
+    plain = OntoGraph(path)
+    indexed = OntoGraph(path, closure=True)
+    assert indexed.closure.depth == 3
+    for node in plain.Graph.nodes:
+        for depth in [0, 1, 2, 3, 1000]:
+            assert indexed.predecessors(node, depth) == plain.predecessors(node, depth)
+            assert indexed.successors(node, depth) == plain.successors(node, depth)
+    assert indexed.predecessors(["HP:0000005", "HP:0000006"], 1000) == [
+        "HP:0000001",
+        "HP:0000002",
+        "HP:0000003",
+        "HP:0000004",
+    ]
+    assert indexed.successors("HP:0000003", 0) == ["HP:0000004", "HP:0000005"]
+
+
+def test_closure_unknown_ids(tmp_path):
+    indexed = OntoGraph(_toy_graph(tmp_path), closure=True)
+    assert indexed.predecessors(["HP:0000005", "HP:9999999"], 1000) == [
+        "HP:0000001",
+        "HP:0000002",
+        "HP:0000003",
+        "HP:0000004",
+    ]
+    assert indexed.predecessors("HP:9999999", 1000) == []
+
+
+def test_array_backend(tmp_path):
+    onto = OntoGraph(_toy_graph(tmp_path))
+    assert onto.root == "HP:0000001"
+    assert onto["hp:0000004"] == {"id": "HP:0000004", "label": "hp:0000004"}
+    assert onto["HP:9999999"] is None
+    assert list(onto.items) == sorted(onto.items)
+    assert "HP:0000006" in onto.items
+    assert onto.predecessors("HP:0000004") == ["HP:0000002", "HP:0000003"]
+    assert onto.successors("HP:0000001", 2) == [
+        "HP:0000002",
+        "HP:0000003",
+        "HP:0000004",
+        "HP:0000006",
+    ]
+    assert sorted(onto.Graph.edges) == sorted(
+        [
+            ("HP:0000001", "HP:0000002"),
+            ("HP:0000001", "HP:0000003"),
+            ("HP:0000002", "HP:0000004"),
+            ("HP:0000003", "HP:0000004"),
+            ("HP:0000004", "HP:0000005"),
+            ("HP:0000002", "HP:0000006"),
+        ]
+    )
+    assert onto.Graph.nodes["HP:0000005"]["label"] == "hp:0000005"
+
+
+def test_snapshot_roundtrip(tmp_path):
+    onto = OntoGraph(_toy_graph(tmp_path), closure=True)
+    path = str(tmp_path / "toy.snap")
+    onto.save(path)
+    mapped = OntoGraph(path)
+    assert mapped.digest == onto.digest
+    assert mapped.closure is not None and mapped.closure.depth == 3
+    assert not mapped.parent_idx.flags.writeable
+    for node in onto.items:
+        assert mapped[node] == onto[node]
+        assert mapped.predecessors(node, 1000) == onto.predecessors(node, 1000)
+        assert mapped.successors(node, 2) == onto.successors(node, 2)
+    restored = pickle.loads(pickle.dumps(mapped))
+    assert restored.successors("HP:0000001", 0) == onto.successors("HP:0000001", 0)
+
+
+def test_ancestor_distances(tmp_path):
+    onto = OntoGraph(_toy_graph(tmp_path))
+    assert onto.ancestor_distances("HP:0000005") == {
+        "HP:0000004": 1,
+        "HP:0000002": 2,
+        "HP:0000003": 2,
+        "HP:0000001": 3,
+    }
+    assert onto.ancestor_distances("HP:0000001") == {}
+    assert onto.ancestor_distances("HP:9999999") == {}
+
+
+def test_closure_csr(tmp_path):
+    onto = OntoGraph(_toy_graph(tmp_path))
+    terms = list(onto.items)
+    for ancestors in [True, False]:
+        ptr, idx = onto.closure_csr(ancestors)
+        for i, id in enumerate(terms):
+            related = [terms[j] for j in idx[ptr[i] : ptr[i + 1]]]
+            if ancestors:
+                assert related == onto.predecessors(id, 0)
+            else:
+                assert related == onto.successors(id, 0)
+    assert list(onto.indices(["HP:0000003", "HP:9999999"])) == [2, -1]
+
+
+def test_cached_snapshot(tmp_path):
+    source = _toy_graph(tmp_path)
+    path = str(tmp_path / "cache" / "toy.snap")
+    built = OntoGraph(source, snapshot=path)
+    assert built._snapshot == path and os.path.exists(path)
+    cached = OntoGraph(source, snapshot=path)
+    assert cached._snapshot == path and cached.digest == built.digest
+
+    # A newer source replaces the stale snapshot.
+    with open(source, "rb") as fp:
+        G = pickle.load(fp)
+    G.add_edge("HP:0000005", "HP:0000007")
+    with open(source, "wb") as fp:
+        pickle.dump(G, fp)
+    rebuilt = OntoGraph(source, snapshot=path)
+    assert rebuilt.digest != built.digest and "HP:0000007" in rebuilt.items
+    assert "HP:0000007" in OntoGraph(source, snapshot=path).items
+
+    # Without a writable cache the source is loaded all the same.
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    onto = OntoGraph(source, snapshot=str(blocker / "toy.snap"))
+    assert onto._snapshot is None and "HP:0000007" in onto.items
@@ -0,0 +1,202 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from rarecrowds.utils import registry
+from rarecrowds.utils.patient_sim import (
+    ImprecisionTable,
+    PatientSampler,
+    onset_interval,
+    sample_onsets,
+    sample_visits,
+)
+
+DISEASES = {
+    "ORPHA:1": {
+        "name": "Disease with frequencies",
+        "ageOnset": ["Childhood"],
+        "phenotype": {
+            "HP:0001250": {"frequency": "HP:0040280"},
+            "HP:0001263": {"frequency": "HP:0040282"},
+            "HP:0000252": {"frequency": "HP:0040284"},
+            "HP:0004322": {"modifier": {"diagnosticCriteria": True}},
+            "HP:0001508": {},
+        },
+    },
+    "ORPHA:2": {
+        "name": "Disease with rare symptoms",
+        "ageOnset": ["Adult", "Elderly"],
+        "phenotype": {
+            "HP:0000365": {"frequency": "HP:0040284"},
+            "HP:0000486": {"frequency": "HP:0040284"},
+        },
+    },
+    "ORPHA:3": {"name": "Disease without phenotype"},
+}
+
+
+@pytest.fixture(scope="module")
+def sampler():
+    return PatientSampler(
+        diseases=SimpleNamespace(data=DISEASES), hpo=registry.shared_hpo()
+    )
+
+
+def test_sample_ideal(sampler):
+    sims = sampler.sample(patient_params="ideal", N=5)
+    assert set(sims) == set(DISEASES)
+    assert [p["phenotype"] for p in sims["ORPHA:3"]["cohort"]] == [None] * 5
+    for patient in sims["ORPHA:1"]["cohort"]:
+        assert list(patient["phenotype"]) == list(DISEASES["ORPHA:1"]["phenotype"])
+
+
+def test_simulations_do_not_share_annotations(sampler):
+    sims = sampler.sample(["ORPHA:1"], patient_params="ideal", N=1)
+    sims["ORPHA:1"]["phenotype"]["HP:0001250"]["frequency"] = "HP:0040281"
+    sims["ORPHA:1"]["phenotype"].clear()
+    assert DISEASES["ORPHA:1"]["phenotype"]["HP:0001250"] == {"frequency": "HP:0040280"}
+    assert len(DISEASES["ORPHA:1"]["phenotype"]) == 5
+
+
+def test_sample_frequencies(sampler):
+    N = 4000
+    sims = sampler.sample(["ORPHA:1", "ORPHA:2"], patient_params="freqs", N=N)
+    cohort = sims["ORPHA:1"]["cohort"]
+    assert len(cohort) == N
+    counts = {hp: 0 for hp in DISEASES["ORPHA:1"]["phenotype"]}
+    for patient in cohort:
+        for hp in patient["phenotype"]:
+            counts[hp] += 1
+    assert counts["HP:0001250"] == N
+    assert 0.30 * N < counts["HP:0001263"] < 0.79 * N
+    assert 0.01 * N < counts["HP:0000252"] < 0.04 * N
+    assert 0.80 * N < counts["HP:0004322"] < 0.99 * N
+    assert 0.05 * N < counts["HP:0001508"] < 0.79 * N
+    # Patients always get at least one symptom, even for rare phenotypes.
+    assert all(patient["phenotype"] for patient in sims["ORPHA:2"]["cohort"])
+
+
+def test_sample_seed_independent_of_workers(sampler):
+    kwargs = dict(patient_params="noise", N=20, seed=42)
+    serial = sampler.sample(**kwargs)
+    assert serial == sampler.sample(**kwargs)
+    assert serial == sampler.sample(workers=2, **kwargs)
+    # A disease's cohort does not depend on which other diseases are sampled.
+    assert sampler.sample("ORPHA:2", **kwargs)["ORPHA:2"] == serial["ORPHA:2"]
+    assert serial != sampler.sample(patient_params="noise", N=20, seed=43)
+
+
+def test_iter_sample_streams_cohorts(sampler):
+    kwargs = dict(patient_params="noise", N=3, seed=7)
+    stream = sampler.iter_sample(["ORPHA:1", "ORPHA:2"], **kwargs)
+    assert next(stream)[0] == "ORPHA:1"
+    assert dict(sampler.iter_sample(workers=2, **kwargs)) == sampler.sample(**kwargs)
+    patients = list(sampler.iter_patients("ORPHA:2", **kwargs))
+    assert [(d, i) for d, i, _ in patients] == [("ORPHA:2", i) for i in range(3)]
+    phenopackets = list(
+        sampler.iter_phenopackets(sampler.iter_sample(**kwargs), num_patients=3)
+    )
+    assert len(phenopackets) == 9
+    assert len({p["id"] for p in phenopackets}) == 9
+    assert len({p["subject"]["id"] for p in phenopackets}) == 3
+
+
+def test_imprecision_table_matches_predecessors():
+    hpo = registry.shared_hpo()
+    terms = ["HP:0001250", "HP:0001263", "HP:0000252", "HP:0000118", "HP:9999999"]
+    table = ImprecisionTable(hpo, terms)
+    for hp in terms:
+        for s in range(12):
+            expected = hp
+            if s:
+                candidates = [
+                    i
+                    for i in hpo.predecessors(hp, depth=s)
+                    if i not in ("HP:0000118", "HP:0000001")
+                ]
+                if candidates:
+                    expected = candidates[min(s - 1, len(candidates) - 1)]
+            s = min(s, table.table.shape[1] - 1)
+            assert table.terms[table.table[table.rows[hp], s]] == expected
+    rng = np.random.default_rng(0)
+    assert table.sample(terms, 0, rng) == terms
+    assert table.sample(["HP:0004322"], 100, rng) != ["HP:0004322"]
+
+
+def test_noise_terms_are_new_and_distinct(sampler):
+    for noise_weights in [None, "frequency"]:
+        sims = sampler.sample(
+            "ORPHA:1", patient_params="noise", N=200, seed=3, noise_weights=noise_weights
+        )
+        for patient in sims["ORPHA:1"]["cohort"]:
+            assert len(patient["phenotype"]) <= 2 * len(DISEASES["ORPHA:1"]["phenotype"])
+    # Only annotated terms are drawn as noise when weighting by frequency.
+    annotated = {hp for d in DISEASES.values() for hp in d.get("phenotype", {})}
+    sims = sampler.sample(
+        "ORPHA:2", patient_params="noise", N=200, seed=3, noise_weights="frequency"
+    )
+    hpo = registry.shared_hpo()
+    for patient in sims["ORPHA:2"]["cohort"]:
+        for hp in patient["phenotype"]:
+            assert hp in annotated or any(
+                hp in hpo.predecessors(a, 1000) for a in DISEASES["ORPHA:2"]["phenotype"]
+            )
+
+
+def test_sample_ages(sampler):
+    rng = np.random.default_rng(0)
+    ages = np.array(sampler.samplePatientAges(["Childhood"], 20000, rng))
+    visits = sample_visits(rng, 20000)
+    assert visits.min() >= -2 / (365 / 7)
+    assert abs(np.median(visits) * 365 / 7 - 2.37) < 0.05
+    assert ages.min() >= 1.8 + visits.min() and ages.max() <= 12.1 + visits.max()
+    assert abs(ages.mean() - 6.84) < 0.1
+    assert sample_onsets(rng, 5, 5, 3).tolist() == [5.0, 5.0, 5.0]
+    assert sample_onsets(rng, np.float64(0.5), np.float64(0.5), 2).tolist() == [0.5] * 2
+    onsets = sample_onsets(rng, 66, None, 20000)
+    assert onsets.min() >= 59.39 and abs(np.median(onsets) - 71.05) < 0.2
+    assert sampler.samplePatientAges(["No data available"], 3, rng) == [None] * 3
+    assert sampler.samplePatientAges(None, 2, rng) == [None] * 2
+    assert onset_interval(("Adult", "Elderly")) == (19, 90)
+
+
+def test_phenopacket_messages_match_json(sampler):
+    from google.protobuf.json_format import ParseDict
+    from rarecrowds.phenopackets_pb2 import Phenopacket
+
+    sims = sampler.sample(patient_params="noise", N=4, seed=5)
+    dicts = sampler.convert_simulations_to_phenopackets(sims, num_patients=4, seed=9)
+    messages = list(sampler.iter_phenopacket_messages(sims, num_patients=4, seed=9))
+    assert len(messages) == 12
+    assert messages == [ParseDict(d, Phenopacket()) for d in dicts]
+    assert len({m.id for m in messages}) == 12
+    assert len({m.subject.id for m in messages}) == 4
+    assert messages[0].subject.id == messages[4].subject.id
+
+
+def test_interleaved_iterators_keep_their_settings(sampler):
+    ideal = sampler.iter_sample(["ORPHA:1", "ORPHA:2"], patient_params="ideal", N=5)
+    noisy = sampler.iter_sample(
+        ["ORPHA:1", "ORPHA:2"], patient_params="noise", N=5, seed=1, workers=2
+    )
+    sampler.sample(patient_params="impre2", N=1, noise_weights="frequency")
+    assert dict(noisy) == sampler.sample(
+        ["ORPHA:1", "ORPHA:2"], patient_params="noise", N=5, seed=1
+    )
+    for patient in dict(ideal)["ORPHA:1"]["cohort"]:
+        assert list(patient["phenotype"]) == list(DISEASES["ORPHA:1"]["phenotype"])
+
+
+def test_phenopacket_ids_depend_on_disease(sampler):
+    def ids(diseases):
+        sims = sampler.iter_sample(diseases, N=3, seed=3)
+        return {
+            (p["id"], p["subject"]["id"])
+            for p in sampler.iter_phenopackets(sims, num_patients=3, seed=3)
+        }
+
+    first, second = ids("ORPHA:1"), ids("ORPHA:2")
+    assert not {id for id, _ in first} & {id for id, _ in second}
+    assert {subject for _, subject in first} == {subject for _, subject in second}
+    assert ids(["ORPHA:1", "ORPHA:2"]) == first | second
@@ -0,0 +1,79 @@
+import os
+
+from rarecrowds import rarecrowds as rc
+from rarecrowds.phenopackets_pb2 import Phenopacket
+from rarecrowds.utils import phenopacket_cache
+
+
+def test_cache_roundtrip(tmp_path):
+    phenopackets = []
+    for i in range(300):
+        phenopacket = Phenopacket(id=f"p{i}")
+        for j in range(i % 7):
+            phenopacket.phenotypic_features.add().type.id = f"HP:{j:07d}"
+        phenopackets.append(phenopacket)
+    folder = tmp_path / "dataset"
+    folder.mkdir()
+    (folder / "a.json").write_text('{"id": "a"}')
+    sources = phenopacket_cache.source_checksums(str(folder))
+    manifest = phenopacket_cache.write_cache("dataset", str(tmp_path), phenopackets, sources)
+    assert manifest["count"] == 300
+    assert phenopacket_cache.read_manifest("dataset", str(tmp_path)) == manifest
+    assert list(phenopacket_cache.read_cache("dataset", str(tmp_path))) == phenopackets
+    assert phenopacket_cache.is_fresh(manifest, str(folder))
+    (folder / "a.json").write_text('{"id": "b"}')
+    assert not phenopacket_cache.is_fresh(manifest, str(folder))
+
+
+def test_load_uses_fresh_cache(tmp_path, monkeypatch):
+    remote = {"test_phenopacket.json": open("test/resources/test_phenopacket.json").read()}
+    downloads = []
+
+    def download_data(dataset, data_path):
+        # Stand-in for the sync: every remote file is written if it changed.
+        downloads.append(dataset)
+        for name, text in remote.items():
+            path = os.path.join(data_path, dataset, name)
+            if not os.path.exists(path) or open(path).read() != text:
+                with open(path, "w") as fp:
+                    fp.write(text)
+
+    parsed = []
+    load_from_folder = rc.PhenotypicDatabase.load_from_folder
+
+    def spy(self, folder, *args, **kwargs):
+        parsed.append(folder)
+        return load_from_folder(self, folder, *args, **kwargs)
+
+    monkeypatch.setattr(rc, "download_data", download_data)
+    monkeypatch.setattr(rc.PhenotypicDatabase, "load_from_folder", spy)
+    os.makedirs(tmp_path / "kleyner-2016")
+    data_path = str(tmp_path)
+    remote["broken.json"] = "{"
+    for expected_parses in [1, 1]:
+        testDB = rc.PhenotypicDatabase()
+        errors = testDB.load("kleyner-2016", data_path)
+        assert len(parsed) == expected_parses
+        assert [os.path.basename(e.path) for e in errors] == ["broken.json"]
+        assert testDB.db["test_phenopacket"].genes[0].symbol == "CNGB3"
+    assert len(downloads) == 2
+
+    # Files updated remotely are seen even though the cache exists.
+    remote["broken.json"] = '{"id": "fixed"}'
+    testDB = rc.PhenotypicDatabase()
+    assert testDB.load("kleyner-2016", data_path) == []
+    assert len(parsed) == 2
+    assert sorted(testDB.db) == ["fixed", "test_phenopacket"]
+
+    testDB = rc.PhenotypicDatabase()
+    testDB.load("kleyner-2016", data_path, refresh=True)
+    assert len(parsed) == 3
+
+    # Offline, the cache of the last synced files is loaded.
+    def offline(dataset, data_path):
+        raise OSError("no connection")
+
+    monkeypatch.setattr(rc, "download_data", offline)
+    testDB = rc.PhenotypicDatabase()
+    assert testDB.load("kleyner-2016", data_path) == []
+    assert len(parsed) == 3 and sorted(testDB.db) == ["fixed", "test_phenopacket"]
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from rarecrowds import PhenotypicDatabase
+from rarecrowds.phenopackets_pb2 import Phenopacket
+from rarecrowds.utils import registry
+from rarecrowds.utils.information_content import annotation_arrays, compute_ic
+from rarecrowds.utils.ranking import DiseaseRanker, top_k
+
+
+@pytest.fixture(scope="module")
+def catalogue():
+    hpo = registry.shared_hpo()
+    rng = np.random.default_rng(0)
+    terms = [str(t) for t in hpo.successors("HP:0000707", 3)]
+    data = {
+        f"ORPHA:{d}": {
+            "phenotype": {t: {} for t in rng.choice(terms, rng.integers(1, 8), replace=False)}
+        }
+        for d in range(60)
+    }
+    data["ORPHA:100"] = {"name": "Disease without phenotype"}
+    queries = [list(rng.choice(terms, n, replace=False)) for n in (1, 3, 6)]
+    return hpo, data, queries
+
+
+def _brute_force(hpo, data, ic, query, method, symmetric):
+    def ancestors(t):
+        return {t} | set(hpo.predecessors(t, 100))
+
+    def sim(q, t):
+        mica = max(ic[hpo._index[a]] for a in ancestors(q) & ancestors(t))
+        if method == "resnik":
+            return mica
+        denominator = ic[hpo._index[q]] + ic[hpo._index[t]]
+        return 2 * mica / denominator if denominator > 0 else 0
+
+    res = {}
+    for d, disease in data.items():
+        terms = list(disease.get("phenotype") or {})
+        if not terms:
+            continue
+        score = np.mean([max(sim(q, t) for t in terms) for q in query])
+        if symmetric:
+            reverse = np.mean([max(sim(q, t) for q in query) for t in terms])
+            score = (score + reverse) / 2
+        res[d] = score
+    return res
+
+
+@pytest.mark.parametrize("method", ["resnik", "lin"])
+@pytest.mark.parametrize("symmetric", [True, False])
+def test_ranker_matches_brute_force(catalogue, method, symmetric):
+    hpo, data, queries = catalogue
+    ranker = DiseaseRanker(data, hpo, method=method, symmetric=symmetric)
+    ic = compute_ic(hpo, annotation_arrays(hpo, data))
+    assert "ORPHA:100" not in ranker.diseases and len(ranker) == 60
+    for query in queries:
+        expected = _brute_force(hpo, data, ic, query, method, symmetric)
+        scores = ranker.scores(query + ["HP:9999999"])
+        assert np.allclose(scores, [expected[d] for d in ranker.diseases])
+        ranking = ranker.rank(query, k=5)
+        assert np.allclose(
+            [score for _, score in ranking], sorted(expected.values())[::-1][:5]
+        )
+
+
+def test_term_diseases(catalogue):
+    hpo, data, queries = catalogue
+    ranker = DiseaseRanker(data, hpo)
+    hp = queries[0][0]
+    assert set(ranker.term_diseases(hp)) == {
+        d
+        for d, disease in data.items()
+        if any(
+            t == hp or hp in hpo.predecessors(t, 100)
+            for t in disease.get("phenotype") or {}
+        )
+    }
+    assert ranker.term_diseases("HP:9999999") == []
+
+
+def test_top_k():
+    scores = np.array([0.5, 2.0, 1.0, 2.0])
+    assert top_k(scores, 3, list("abcd")) == [("b", 2.0), ("d", 2.0), ("c", 1.0)]
+    assert top_k(scores, 10, list("abcd"))[-1] == ("a", 0.5)
+    assert top_k(scores, 0, list("abcd")) == []
+    with pytest.raises(ValueError):
+        DiseaseRanker({}, method="cosine")
+
+
+def test_rank_cohort(catalogue, tmp_path):
+    hpo, data, queries = catalogue
+    ranker = DiseaseRanker(data, hpo)
+    simulations = {
+        "ORPHA:1": {"cohort": [{"phenotype": q} for q in queries]},
+        "ORPHA:2": {"cohort": [{"phenotype": []}]},
+        "ORPHA:3": {},
+    }
+    expected = [
+        (("ORPHA:1", i), ranker.rank(query, k=3)) for i, query in enumerate(queries)
+    ] + [(("ORPHA:2", 0), ranker.rank([], k=3))]
+    # A tiny memory budget puts every patient in its own block.
+    for memory in (1, 1 << 28):
+        assert list(ranker.rank_cohort(simulations, k=3, memory=memory)) == expected
+    assert list(ranker.rank_cohort(simulations.items(), k=3, workers=2)) == expected
+
+    path = str(tmp_path / "ranker.snap")
+    ranker.save(path)
+    loaded = DiseaseRanker.load(path, hpo)
+    assert loaded.diseases == ranker.diseases
+    assert np.array_equal(loaded.scores(queries[1]), ranker.scores(queries[1]))
+
+    db = PhenotypicDatabase()
+    phenopacket = Phenopacket(id="p1")
+    for hp in queries[2]:
+        phenopacket.phenotypic_features.add().type.id = hp
+    phenopacket.phenotypic_features.add(negated=True).type.id = "HP:0000118"
+    db.add_phenopacket(phenopacket)
+    assert list(ranker.rank_cohort(db, k=3)) == [("p1", ranker.rank(queries[2], k=3))]
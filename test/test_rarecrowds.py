@@ -1,8 +1,10 @@
 import glob
 import os
 
+import pytest
+
 from rarecrowds.phenopackets_pb2 import Phenopacket
-from rarecrowds.rarecrowds import PhenotypicDatabase
+from rarecrowds.rarecrowds import PhenopacketLoadError, PhenotypicDatabase
 
 
 def test_add_phenopacket():
@@ -46,6 +48,16 @@ def test_load_from_file():
     assert phenopacket.diseases[0].term.label == "Achromatopsia"
 
 
+def test_load_from_file_errors(tmp_path):
+    path = tmp_path / "broken.json"
+    path.write_text("{")
+    with pytest.raises(PhenopacketLoadError) as info:
+        PhenotypicDatabase().load_from_file(str(path))
+    assert info.value.path == str(path)
+    with pytest.raises(PhenopacketLoadError):
+        PhenotypicDatabase().load_from_file(str(tmp_path / "missing.json"))
+
+
 def test_load_from_folder():
     test_file_path = "test/resources"
     testDB = PhenotypicDatabase()
@@ -74,3 +86,156 @@ def test_load():
     testDB.load("kleyner-2016")
     assert os.path.exists("rarecrowds_data/kleyner-2016")
     assert len(glob.glob("rarecrowds_data/kleyner-2016/*.json")) == 1
+
+
+def test_load_simulated_data():
+    from types import SimpleNamespace
+
+    from rarecrowds.utils import registry
+    from rarecrowds.utils.patient_sim import PatientSampler
+
+    testDB = PhenotypicDatabase()
+    testDB._patient_sampler = PatientSampler(
+        diseases=SimpleNamespace(
+            data={"ORPHA:1": {"phenotype": {"HP:0001250": {}, "HP:0001263": {}}}}
+        ),
+        hpo=registry.shared_hpo(),
+    )
+    testDB.load_simulated_data(patient_params="ideal", num_patients=3, seed=1)
+    assert len(testDB.db) == 3
+    with pytest.raises(ValueError):
+        testDB.load_simulated_data(patient_params="unknown")
+    for phenopacket in testDB.db.values():
+        assert [f.type.id for f in phenopacket.phenotypic_features] == [
+            "HP:0001250",
+            "HP:0001263",
+        ]
+        assert phenopacket.meta_data.resources[0].namespace_prefix == "HP"
+
+
+def test_incidence_matrix():
+    from rarecrowds.utils import registry
+
+    hpo = registry.shared_hpo()
+    testDB = PhenotypicDatabase()
+    for id, features in [
+        ("p1", [("HP:0001250", False), ("HP:0001263", False), ("HP:0000252", True)]),
+        ("p2", [("HP:0001250", False), ("HP:9999999", False)]),
+        ("p3", []),
+    ]:
+        phenopacket = Phenopacket(id=id)
+        for hp, negated in features:
+            feature = phenopacket.phenotypic_features.add()
+            feature.type.id = hp
+            feature.negated = negated
+        testDB.add_phenopacket(phenopacket)
+
+    matrix = testDB.incidence_matrix(hpo=hpo)
+    assert list(matrix.rows) == ["p1", "p2", "p3"]
+    assert list(matrix.columns[: len(hpo.items)]) == list(hpo.items)
+    assert matrix.columns[-1] == "HP:9999999"
+    col = {hp: i for i, hp in enumerate(matrix.columns)}
+    assert matrix.observed.shape == (3, len(hpo.items) + 1)
+    assert sorted(matrix.columns[matrix.observed[0].indices]) == ["HP:0001250", "HP:0001263"]
+    assert sorted(matrix.columns[matrix.observed[1].indices]) == ["HP:0001250", "HP:9999999"]
+    assert list(matrix.columns[matrix.excluded[0].indices]) == ["HP:0000252"]
+    assert matrix.observed[2].nnz == 0
+
+    matrix = testDB.incidence_matrix(propagate=True, hpo=hpo)
+    observed = set(matrix.columns[matrix.observed[0].indices])
+    expected = {"HP:0001250", "HP:0001263"}
+    expected.update(hpo.predecessors(["HP:0001250", "HP:0001263"], 0))
+    assert observed == expected
+    assert matrix.observed.data.max() == 1
+    excluded = set(matrix.columns[matrix.excluded[0].indices])
+    assert excluded == {"HP:0000252", *hpo.successors("HP:0000252", 0)}
+    assert matrix.observed[1, col["HP:9999999"]] == 1
+
+
+def test_generate_dataframe_matches_json():
+    import pandas as pd
+
+    testDB = PhenotypicDatabase()
+    testDB.load_from_folder("test/resources")
+    for id in ["p1", "p2"]:
+        phenopacket = Phenopacket(id=id)
+        phenopacket.phenotypic_features.add().type.id = "HP:0001250"
+        testDB.add_phenopacket(phenopacket)
+    testDB.db["p2"].subject.id = "s2"
+
+    for include_hpo_terms in [True, False]:
+        expected = pd.json_normalize(testDB.generate_list_of_dicts(include_hpo_terms))
+        expected = expected[[f for f in testDB.fields if f in expected.columns]]
+        df = testDB.generate_dataframe(include_hpo_terms)
+        pd.testing.assert_frame_equal(df, expected)
+
+
+def test_load_from_folder_errors_and_resume(tmp_path, monkeypatch):
+    import shutil
+
+    # Workers are capped to the CPUs, keep the pool path tested on any machine.
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+
+    shutil.copy("test/resources/test_phenopacket.json", tmp_path / "a.json")
+    for i in range(5):
+        (tmp_path / f"sim{i}.json").write_text(f'{{"id": "sim{i}"}}')
+    (tmp_path / "broken.json").write_text('{"id": ')
+    (tmp_path / "unknown.json").write_text('{"notAField": 1}')
+
+    for workers in [1, 2]:
+        testDB = PhenotypicDatabase()
+        reports = []
+        errors = testDB.load_from_folder(
+            str(tmp_path), workers=workers, progress=reports.append, chunk_size=2
+        )
+        assert sorted(testDB.db) == ["sim0", "sim1", "sim2", "sim3", "sim4", "test_phenopacket"]
+        assert [os.path.basename(e.path) for e in errors] == ["broken.json", "unknown.json"]
+        assert reports[-1].done == reports[-1].total == 8
+        assert reports[-1].loaded == 6 and reports[-1].errors == 2
+
+    # Files already loaded are skipped, only new content is parsed.
+    (tmp_path / "sim5.json").write_text('{"id": "sim5"}')
+    reports = []
+    testDB.load_from_folder(str(tmp_path), progress=reports.append)
+    assert "sim5" in testDB.db
+    assert (reports[-1].loaded, reports[-1].skipped, reports[-1].errors) == (1, 6, 2)
+
+
+def test_query_terms():
+    from rarecrowds.utils import registry
+
+    hpo = registry.shared_hpo()
+    seizure, dd, micro = "HP:0001250", "HP:0001263", "HP:0000252"
+    abnormality = "HP:0000707"  # Abnormality of the nervous system
+    testDB = PhenotypicDatabase()
+
+    def add(id, terms, negated=()):
+        phenopacket = Phenopacket(id=id)
+        for hp in terms:
+            phenopacket.phenotypic_features.add().type.id = hp
+        for hp in negated:
+            feature = phenopacket.phenotypic_features.add()
+            feature.type.id = hp
+            feature.negated = True
+        testDB.add_phenopacket(phenopacket)
+
+    add("p1", [seizure, dd])
+    add("p2", [seizure], negated=[micro])
+    add("p3", [micro, "HP:9999999"])
+    assert abnormality in hpo.predecessors(seizure, 0)
+    assert testDB.query(all_of=[seizure]) == ["p1", "p2"]
+    assert testDB.query(all_of=[abnormality]) == ["p1", "p2", "p3"]
+    assert testDB.query(all_of=[seizure, dd]) == ["p1"]
+    assert testDB.query(any_of=[dd, micro]) == ["p1", "p3"]
+    assert testDB.query(none_of=[seizure]) == ["p3"]
+    assert testDB.query(all_of=["HP:9999999"]) == ["p3"]
+    assert testDB.query_at_least([seizure, dd, micro], 2) == ["p1"]
+    assert testDB.query_at_least([seizure, dd, micro], 1) == ["p1", "p2", "p3"]
+
+    # The index is updated as phenopackets are added or replaced.
+    add("p4", [dd, micro])
+    add("p1", [micro])
+    assert testDB.query(all_of=[micro]) == ["p3", "p4", "p1"]
+    assert testDB.query(all_of=[seizure]) == ["p2"]
+    assert testDB.query_at_least([seizure, dd, micro], 2) == ["p4"]
+    assert testDB.term_index.query(all_of=[dd]) == ["p4"]
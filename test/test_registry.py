@@ -0,0 +1,28 @@
+from rarecrowds.utils import registry
+
+
+class _Resource:
+    def __init__(self, path):
+        with open(path) as fp:
+            self.data = fp.read()
+
+
+def test_shared_instances(tmp_path):
+    path = tmp_path / "resource.txt"
+    path.write_text("v1")
+    first = registry.get_shared(_Resource, [str(path)], str(path))
+    assert registry.get_shared(_Resource, [str(path)], str(path)) is first
+
+    registry.invalidate(str(path))
+    second = registry.get_shared(_Resource, [str(path)], str(path))
+    assert second is not first and second.data == "v1"
+
+    path.write_text("v2 with a different size")
+    third = registry.get_shared(_Resource, [str(path)], str(path))
+    assert third is not second and third.data == "v2 with a different size"
+
+
+def test_shared_hpo():
+    hpo = registry.shared_hpo()
+    assert registry.shared_hpo() is hpo
+    assert hpo.closure is not None
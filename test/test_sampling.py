@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from rarecrowds.utils.sampling import as_weights, sample_complement
+
+
+def test_as_weights():
+    assert as_weights([0, 1, 2]).dtype == float
+    for weights in [[0, 0], [], [1, -1], [[1]]]:
+        with pytest.raises(ValueError):
+            as_weights(weights)
+
+
+@pytest.mark.parametrize("weighted", [False, True])
+def test_sample_complement(weighted):
+    rng = np.random.default_rng(1)
+    n = 10
+    weights = [0] + [1] * (n - 1) if weighted else None
+    excluded = [[], [1, 3, 5], list(range(n)), [2, 9, 4, 7, 8]]
+    counts = [n, 4, 3, 10]
+    for _ in range(50):
+        drawn = sample_complement(rng, n, excluded, counts, weights)
+        for res, ex, count in zip(drawn, excluded, counts):
+            free = set(range(int(weighted), n)) - set(ex)
+            assert len(res) == min(count, len(free))
+            assert len(set(res.tolist())) == len(res)
+            assert set(res.tolist()) <= free
+
+
+def test_sample_complement_uniform():
+    rng = np.random.default_rng(2)
+    drawn = sample_complement(rng, 6, [[0, 2]] * 20000, [2] * 20000)
+    freqs = np.bincount(np.concatenate(drawn), minlength=6) / 40000
+    assert np.allclose(freqs, [0, 0.25, 0, 0.25, 0.25, 0.25], atol=0.01)
+
+
+def test_sample_complement_weighted():
+    rng = np.random.default_rng(3)
+    weights = [1, 2, 0, 3, 4]
+    drawn = sample_complement(rng, 5, [[3]] * 20000, [1] * 20000, weights)
+    freqs = np.bincount(np.concatenate(drawn), minlength=5) / 20000
+    assert np.allclose(freqs, [1 / 7, 2 / 7, 0, 0, 4 / 7], atol=0.01)
+    # A row that takes every free value gets each exactly once.
+    drawn = sample_complement(rng, 5, [[1]], [5], weights)
+    assert sorted(drawn[0].tolist()) == [0, 3, 4]
@@ -0,0 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from rarecrowds import PhenotypicDatabase
+from rarecrowds.phenopackets_pb2 import Phenopacket
+from rarecrowds.utils.sqlite_store import SqliteStore
+
+
+def _phenopacket(i, hpos):
+    phenopacket = Phenopacket(id=f"p{i}")
+    phenopacket.subject.id = f"s{i % 3}"
+    for hp in hpos:
+        phenopacket.phenotypic_features.add().type.id = hp
+    phenopacket.diseases.add().term.id = f"ORPHA:{i % 2}"
+    phenopacket.genes.add().symbol = "FBN1"
+    return phenopacket
+
+
+def _count(path):
+    with SqliteStore(path) as store:
+        return len(store), store.ids_by_term("HP:0000002")
+
+
+def test_sqlite_store(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    store = SqliteStore(path, batch_size=4)
+    for i in range(10):
+        store[f"p{i}"] = _phenopacket(i, ["HP:0000001", f"HP:000000{i % 3 + 1}"])
+    store["p4"] = _phenopacket(4, ["HP:0000003"])
+    assert "p9" in store and "p10" not in store
+    assert len(store) == 10
+    assert list(store) == [f"p{i}" for i in range(10)]
+    assert store["p4"].phenotypic_features[0].type.id == "HP:0000003"
+    assert [p.id for p in store.values()] == list(store)
+    assert store.ids_by_subject("s1") == ["p1", "p4", "p7"]
+    assert store.ids_by_term("HP:0000002") == ["p1", "p7"]
+    assert store.ids_by_disease("ORPHA:1") == ["p1", "p3", "p5", "p7", "p9"]
+    assert len(store.ids_by_gene("FBN1")) == 10
+    del store["p7"]
+    assert store.ids_by_term("HP:0000002") == ["p1"]
+    store.close()
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(_count, [path, path]))
+    assert results == [(9, ["p1"])] * 2
+
+
+def test_database_storage(tmp_path):
+    path = str(tmp_path / "db.sqlite")
+    memory = PhenotypicDatabase()
+    stored = PhenotypicDatabase(storage=path)
+    for i in range(5):
+        phenopacket = _phenopacket(i, ["HP:0000118"])
+        memory.add_phenopacket(phenopacket)
+        stored.add_phenopacket(phenopacket)
+    stored.close()
+    reopened = PhenotypicDatabase(storage=path)
+    assert reopened.generate_dataframe().equals(memory.generate_dataframe())
+    assert reopened.query(all_of=["HP:0000118"]) == memory.query(all_of=["HP:0000118"])
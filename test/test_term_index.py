@@ -0,0 +1,46 @@
+import numpy as np
+
+from rarecrowds.phenopackets_pb2 import Phenopacket
+from rarecrowds.utils import registry
+from rarecrowds.utils.term_index import TermIndex
+
+
+def test_term_index_matches_scan():
+    hpo = registry.shared_hpo()
+    rng = np.random.default_rng(0)
+    terms = list(rng.choice(list(hpo.items), 40, replace=False))
+    phenopackets = []
+    for i in range(300):
+        phenopacket = Phenopacket(id=f"p{i % 250}")
+        for hp in rng.choice(terms, rng.integers(0, 6), replace=False):
+            phenopacket.phenotypic_features.add().type.id = hp
+        phenopackets.append(phenopacket)
+
+    index = TermIndex(hpo, compact_every=50)
+    index.extend(phenopackets[:100])
+    for phenopacket in phenopackets[100:]:
+        index.add(phenopacket)
+    latest = {}
+    for phenopacket in phenopackets:
+        latest.pop(phenopacket.id, None)
+        latest[phenopacket.id] = phenopacket
+    closure = {
+        id: set(
+            hpo.predecessors([f.type.id for f in p.phenotypic_features], 0)
+            + [f.type.id for f in p.phenotypic_features]
+        )
+        for id, p in latest.items()
+    }
+    assert len(index) == len(latest)
+    queried = [hpo.predecessors(hp, 2)[0] for hp in terms[:5]] + terms[:5]
+    for hp in queried:
+        assert index.query(all_of=[hp]) == [id for id, c in closure.items() if hp in c]
+    a, b, c = queried[:3]
+    assert index.query(all_of=[a], any_of=[b, c], none_of=[terms[7]]) == [
+        id
+        for id, t in closure.items()
+        if a in t and (b in t or c in t) and terms[7] not in t
+    ]
+    assert index.at_least(queried, 3) == [
+        id for id, t in closure.items() if len(t & set(queried)) >= 3
+    ]
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from rarecrowds.utils import registry
+from rarecrowds.utils.ranking import DiseaseRanker
+from rarecrowds.utils.term_similarity import TermSimilarity
+
+
+@pytest.fixture(scope="module")
+def ranker():
+    hpo = registry.shared_hpo()
+    rng = np.random.default_rng(0)
+    terms = [str(t) for t in hpo.successors("HP:0000707", 3)]
+    data = {
+        f"ORPHA:{d}": {
+            "phenotype": {t: {} for t in rng.choice(terms, 5, replace=False)}
+        }
+        for d in range(40)
+    }
+    return DiseaseRanker(data, hpo)
+
+
+def test_term_similarity(ranker):
+    hpo = ranker.hpo
+    ic = ranker.ic
+    similarity = TermSimilarity(
+        ranker, block_size=7, memory=8 * 7 * len(ranker.terms) * 2
+    )
+    assert similarity.max_blocks == 2 and len(similarity) == len(ranker.terms)
+
+    def mica(a, b):
+        common = ({a} | set(hpo.predecessors(a, 100))) & (
+            {b} | set(hpo.predecessors(b, 100))
+        )
+        return max(ic[hpo._index[t]] for t in common)
+
+    terms = similarity.terms
+    for a in terms[::5]:
+        assert np.allclose(similarity.row(a), [mica(a, b) for b in terms])
+        assert len(similarity._blocks) <= 2
+    assert similarity.similarity(terms[0], terms[1]) == mica(terms[0], terms[1])
+    # No term is more similar to a term than itself.
+    assert similarity.most_similar(terms[3], k=1)[0][1] == ic[hpo._index[terms[3]]]
+    with pytest.raises(KeyError):
+        similarity.row("HP:0000118")
+
+    dense = np.vstack([similarity.row(a) for a in terms])
+    matrix = similarity.sparse(1.0)
+    assert np.array_equal(matrix.toarray(), np.where(dense >= 1.0, dense, 0))
+    assert matrix.nnz == np.count_nonzero(dense >= 1.0)